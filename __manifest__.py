@@ -1,6 +1,6 @@
 {
     'name': 'Stock Negative Prevention',
-    'version': '18.0.1.0.0',
+    'version': '18.0.1.1.0',
     'category': 'Inventory/Inventory',
     'summary': 'Empêche les ventes avec stock négatif pour les modules Vente et Point de Vente',
     'description': """
@@ -33,9 +33,18 @@ Installation:
     ],
     'data': [
         'security/ir.model.access.csv',
+        'security/stock_shortage_report_security.xml',
+        'data/ir_cron.xml',
+        'views/stock_prevention_source_views.xml',
         'views/res_config_settings_views.xml',
+        'views/stock_shortage_report_views.xml',
         'views/sale_order_views.xml',
     ],
+    'assets': {
+        'point_of_sale._assets_pos': [
+            'stock_negative_prevention/static/src/js/pos_stock_validation.js',
+        ],
+    },
     'installable': True,
     'auto_install': False,
     'application': False,
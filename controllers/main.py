@@ -0,0 +1,28 @@
+import hmac
+
+from werkzeug.exceptions import Forbidden, NotFound
+
+from odoo import http
+from odoo.http import request
+
+
+class StockPreventionMetricsController(http.Controller):
+
+    @http.route('/stock_negative_prevention/metrics', type='http', auth='none', methods=['GET'], save_session=False)
+    def metrics(self):
+        """Métriques du worker courant au format texte Prometheus.
+
+        Route sans session, pour un collecteur : elle exige le jeton du paramètre
+        stock_negative_prevention.metrics_token dans l'en-tête
+        « Authorization: Bearer <jeton> ». Sans jeton configuré, elle est désactivée.
+        """
+        if not request.db:
+            raise NotFound()
+        expected = request.env['ir.config_parameter'].sudo().get_param('stock_negative_prevention.metrics_token')
+        if not expected:
+            raise NotFound()
+        scheme, _separator, token = request.httprequest.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), expected.encode()):
+            raise Forbidden()
+        body = request.env['stock.prevention.metrics'].sudo()._get_prometheus_metrics()
+        return request.make_response(body, headers=[('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')])
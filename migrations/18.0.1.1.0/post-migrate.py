@@ -0,0 +1,35 @@
+from odoo import api, SUPERUSER_ID
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Reporte les anciens paramètres globaux (ir.config_parameter) sur chaque société"""
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    ICP = env['ir.config_parameter']
+    companies = env['res.company'].search([])
+
+    values = {}
+    for key, field_name in (
+        ('prevent_sales', 'prevent_negative_stock_sales'),
+        ('prevent_pos', 'prevent_negative_stock_pos'),
+    ):
+        # get_param retourne False quand le paramètre n'existe pas
+        param = ICP.get_param(f'stock_negative_prevention.{key}')
+        if param:
+            values[field_name] = param in ('True', 'true', '1', 'yes')
+            ICP.set_param(f'stock_negative_prevention.{key}', False)
+    if values:
+        companies.write(values)
+
+    location_id = ICP.get_param('stock_negative_prevention.stock_location_id')
+    if location_id:
+        location = env['stock.location'].browse(int(location_id)).exists() if location_id.isdigit() else None
+        if location:
+            companies.filtered(
+                lambda company: not location.company_id or location.company_id == company
+            ).write({'stock_prevention_location_id': location.id})
+        ICP.set_param('stock_negative_prevention.stock_location_id', False)
+
+    _logger.info("STOCK PREVENTION MIGRATION: Paramètres %s reportés sur %s société(s)", values, len(companies))
@@ -1,3 +1,15 @@
+from . import res_company
 from . import res_config_settings
+from . import stock_prevention_metrics
+from . import stock_prevention_source
+from . import stock_prevention_check_queue
+from . import stock_shortage_report
+from . import stock_available_snapshot
+from . import stock_location
+from . import stock_quant
+from . import stock_warehouse
+from . import stock_picking_type
 from . import sale_order
+from . import pos_config
+from . import pos_session
 from . import pos_order
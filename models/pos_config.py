@@ -0,0 +1,49 @@
+from odoo import api, fields, models, tools
+
+# Champs de pos.config intervenant dans la résolution mise en cache par session / configuration
+STOCK_PREVENTION_POS_CONFIG_FIELDS = {
+    'picking_type_id',
+    'company_id',
+    'stock_prevention_pos',
+    'stock_prevention_location_id',
+}
+
+
+class PosConfig(models.Model):
+    _inherit = 'pos.config'
+
+    stock_prevention_pos = fields.Selection(
+        [
+            ('company', "Selon la société"),
+            ('enabled', "Activée"),
+            ('disabled', "Désactivée"),
+        ],
+        string="Prévention Stock Négatif",
+        default='company',
+        required=True,
+    )
+    stock_prevention_location_id = fields.Many2one(
+        'stock.location',
+        string="Emplacement de vérification",
+        domain="[('usage', '=', 'internal'), ('company_id', 'in', (company_id, False))]",
+        help="Si vide, l'emplacement source du type d'opération du point de vente est vérifié."
+    )
+
+    def write(self, vals):
+        """Override pour invalider l'emplacement de vérification mis en cache par session"""
+        res = super().write(vals)
+        if STOCK_PREVENTION_POS_CONFIG_FIELDS & set(vals):
+            self.env.registry.clear_cache()
+        return res
+
+    @api.model
+    @tools.ormcache('config_id')
+    def _get_stock_prevention_settings(self, config_id):
+        """Paramètres de prévention d'un point de vente : ceux de sa société,
+        avec l'activation et l'emplacement propres au point de vente."""
+        config = self.sudo().browse(config_id)
+        settings = dict(self.env['res.company']._get_stock_prevention_settings(config.company_id.id))
+        if config.stock_prevention_pos != 'company':
+            settings['pos'] = config.stock_prevention_pos == 'enabled'
+        settings['location_id'] = config.stock_prevention_location_id.id
+        return settings
@@ -1,9 +1,12 @@
-from odoo import api, fields, models, _
+from odoo import api, fields, models, tools, _
 from odoo.exceptions import UserError
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# Nombre maximal de produits détaillés dans un message d'erreur POS
+SHORTAGE_MESSAGE_MAX_PRODUCTS = 20
+
 
 class PosOrder(models.Model):
     _inherit = 'pos.order'
@@ -31,123 +34,290 @@ class PosOrder(models.Model):
         location = getattr(picking_type, 'default_location_src_id', False) or warehouse.lot_stock_id
         return warehouse, location
 
+    @api.model
+    @tools.ormcache('session_id')
+    def _get_stock_check_location_ids(self, session_id):
+        """Résolution session -> config -> picking type -> entrepôt -> emplacement,
+        mémorisée par session (identifiants uniquement).
+
+        Le cache est vidé lorsque pos.config, stock.picking.type ou stock.warehouse
+        modifient un champ intervenant dans cette résolution.
+        """
+        session = self.env['pos.session'].browse(session_id)
+        location_id = self.env['pos.config']._get_stock_prevention_settings(session.config_id.id)['location_id']
+        if location_id:
+            # Emplacement de vérification configuré sur le point de vente
+            location = self.env['stock.location'].browse(location_id)
+            return location.warehouse_id.id, location.id
+        picking_type = session.config_id.picking_type_id
+        if not picking_type:
+            return False, False
+        warehouse, location = self._get_stock_check_warehouse_location(session, picking_type)
+        return (warehouse.id if warehouse else False), (location.id if location else False)
+
+    def _get_session_stock_check_warehouse_location(self, session):
+        """Version mise en cache de _get_stock_check_warehouse_location pour une session"""
+        warehouse_id, location_id = self._get_stock_check_location_ids(session.id)
+        return self.env['stock.warehouse'].browse(warehouse_id), self.env['stock.location'].browse(location_id)
+
+    @api.model
+    def _get_pos_stock_prevention_settings(self, session_id):
+        """Paramètres de prévention du point de vente d'une session (mis en cache, voir pos.config)"""
+        session = self.env['pos.session'].browse(session_id)
+        return self.env['pos.config']._get_stock_prevention_settings(session.config_id.id)
+
     def _get_available_quantity(self, product, location):
         """Récupère la quantité disponible d'un produit dans un emplacement
         Méthode inspirée du module mrp_stock_validation pour un calcul correct"""
-        quants = self.env['stock.quant'].search([
-            ('product_id', '=', product.id),
-            ('location_id', 'child_of', location.id),
-        ])
-        available_qty = sum(quants.mapped('available_quantity'))
-        _logger.info(f"POS STOCK PREVENTION: Calcul stock pour {product.display_name} dans {location.name}: {available_qty}")
-        return available_qty
-
-    def _process_order(self, order, draft, existing_order=None):
+        return self._get_available_quantity_map(product, location).get(product.id, 0.0)
+
+    def _get_available_quantity_map(self, products, location):
+        """Récupère les quantités disponibles de plusieurs produits en une requête"""
+        available = self.env['stock.quant']._get_available_quantity_map(products, location)
+        _logger.debug("POS STOCK PREVENTION: Calcul stock pour %s produit(s) dans l'emplacement %s", len(available), location.id)
+        return available
+
+    def _process_order(self, order, existing_order):
         """Override pour vérifier le stock avant traitement de la commande POS"""
-        # Vérifier si la prévention est activée (get_param retourne une string)
-        prevent_negative_param = self.env['ir.config_parameter'].sudo().get_param(
-            'stock_negative_prevention.prevent_pos', 'False'
-        )
-        prevent_negative = prevent_negative_param in ('True', 'true', '1', 'yes')
+        prevent_negative = self._get_pos_stock_prevention_settings(order.get('session_id'))['pos']
         
-        _logger.info(f"POS STOCK PREVENTION: prevent_negative_param={prevent_negative_param}, prevent_negative={prevent_negative}")
+        _logger.debug("POS STOCK PREVENTION: prevent_negative=%s", prevent_negative)
         
-        if prevent_negative and not draft:
+        # Les commandes d'une synchronisation en lot sont déjà vérifiées par sync_from_ui ;
+        # un brouillon n'engage pas de stock
+        if (
+            prevent_negative
+            and order.get('state') != 'draft'
+            and not self.env.context.get('stock_prevention_pos_orders_checked')
+        ):
             self._check_pos_stock_availability(order)
         
-        # Appeler la méthode parent avec les bons arguments selon la version d'Odoo
-        if existing_order is not None:
-            return super()._process_order(order, draft, existing_order)
-        else:
-            return super()._process_order(order, draft)
+        # Les lignes créées à partir de cette commande sont soit déjà vérifiées,
+        # soit un brouillon : PosOrderLine.create ne doit pas les revérifier
+        pos_order = self.with_context(stock_prevention_skip_line_check=True)
+        return super(PosOrder, pos_order)._process_order(order, existing_order)
 
-    def _check_pos_stock_availability(self, order):
-        """Vérifie la disponibilité du stock pour toutes les lignes de commande POS"""
-        insufficient_products = []
-        
-        for line in order.get('lines', []):
-            product_id = line[2].get('product_id')
-            qty = line[2].get('qty', 0)
-            
-            if product_id and qty > 0:
-                product = self.env['product.product'].browse(product_id)
-                
-                # Vérifier les produits stockables ET consommables (qui peuvent avoir du stock)
-                if product.type in ('product', 'consu'):
-                    # Déterminer l'emplacement de stock à vérifier
+    @api.model
+    def _get_pos_stock_demand(self, order):
+        """Regroupe la demande d'une commande POS (données JSON) par produit.
+
+        Les lignes POS sont saisies dans l'unité du produit : les quantités d'un
+        même produit sont simplement additionnées.
+        Retourne {product: [quantité demandée, numéros des lignes concernées]}.
+        """
+        demand = {}
+        # Paramètres résolus une fois pour la commande (exclusions de produits et de catégories)
+        settings = self._get_pos_stock_prevention_settings(order.get('session_id'))
+        Company = self.env['res.company']
+        lines = [line[2] for line in order.get('lines', [])]
+        # Parcourir les produits avec un prefetch commun (une lecture pour toute la commande)
+        products = self.env['product.product'].browse([vals['product_id'] for vals in lines if vals.get('product_id')])
+        for position, vals in enumerate(lines, start=1):
+            product_id = vals.get('product_id')
+            qty = vals.get('qty', 0)
+            if not product_id or qty <= 0:
+                continue
+            product = self.env['product.product'].browse(product_id).with_prefetch(products._prefetch_ids)
+            if not Company._is_stock_checked_product(settings, product):
+                continue
+            product_demand = demand.setdefault(product, [0.0, []])
+            product_demand[0] += qty
+            product_demand[1].append(position)
+        return demand
+
+    @api.model
+    def sync_from_ui(self, orders):
+        """Override pour valider le stock de toutes les commandes synchronisées en une fois.
+
+        Lors de la reconnexion d'une caisse, la file de commandes hors ligne est
+        validée en lot (voir _check_pos_orders_stock_availability) au lieu d'une
+        vérification indépendante par commande dans _process_order.
+        """
+        # Commandes déjà enregistrées et validées (ex. pourboire saisi plus tard), en une
+        # recherche : super() les renvoie sans les retraiter, leur stock a déjà été décompté
+        uuids = [order['uuid'] for order in orders if order.get('uuid')]
+        validated_uuids = set(self.search([
+            ('uuid', 'in', uuids),
+            ('state', '!=', 'draft'),
+        ]).mapped('uuid')) if uuids else set()
+        checked_orders = [
+            order for order in orders
+            if order.get('state') != 'draft'
+            and order.get('uuid') not in validated_uuids
+            # Activation propre au point de vente de chaque commande
+            and self._get_pos_stock_prevention_settings(order.get('session_id'))['pos']
+        ]
+        if checked_orders:
+            verdicts = self._check_pos_orders_stock_availability(checked_orders)
+            rejected = [verdict for verdict in verdicts if not verdict['ok']]
+            if rejected:
+                raise UserError("\n".join(
+                    _("Commande %(order)s :\n%(message)s") % {
+                        'order': verdict['name'],
+                        'message': self._get_pos_stock_shortage_message(verdict['insufficient_products']),
+                    }
+                    for verdict in rejected
+                ))
+        # Toute la file est vérifiée ici : _process_order ne revérifie aucune commande
+        pos_order = self.with_context(stock_prevention_pos_orders_checked=True)
+        return super(PosOrder, pos_order).sync_from_ui(orders)
+
+    @api.model
+    def _get_pos_session_stock_location(self, session):
+        """Retourne (entrepôt, emplacement) de vérification pour une session POS.
+
+        Lève une UserError si la configuration du POS ne permet pas de les déterminer.
+        """
+        warehouse = None
+        location = None
+
+        if session and session.config_id and session.config_id.picking_type_id:
+            picking_type = session.config_id.picking_type_id
+
+            warehouse, location = self._get_session_stock_check_warehouse_location(session)
+            if _logger.isEnabledFor(logging.DEBUG):
+                _logger.debug(
+                    "POS STOCK PREVENTION DEBUG: session=%s config=%s picking_type=%s warehouse=%s lot_stock_id=%s",
+                    session.display_name,
+                    session.config_id.display_name,
+                    picking_type.display_name,
+                    warehouse.display_name if warehouse else None,
+                    warehouse.lot_stock_id.display_name if getattr(warehouse, 'lot_stock_id', False) else None,
+                )
+
+            if not warehouse or not warehouse.lot_stock_id:
+                raise UserError(_(
+                    "Le type d'opération du POS %(picking_type)s n'a pas d'entrepôt ou d'emplacement de stock principal.\n"
+                    "Configurez warehouse_id et son lot_stock_id sur l'entrepôt lié au picking type."
+                ) % {
+                    'picking_type': picking_type.display_name,
+                })
+
+            if warehouse and location:
+                _logger.debug(
+                    "POS STOCK PREVENTION: Utilisation entrepôt %s (emplacement: %s)", warehouse.id, location.id,
+                )
+
+        if not location:
+            # Impossible de déterminer la localisation de stock du POS
+            _logger.warning(
+                "POS STOCK PREVENTION DEBUG: location introuvable pour session=%s, config=%s, picking_type=%s",
+                session.display_name if session else None,
+                session.config_id.display_name if session and session.config_id else None,
+                session.config_id.picking_type_id.display_name if session and session.config_id and session.config_id.picking_type_id else None,
+            )
+            raise UserError(_(
+                "Impossible de déterminer l'emplacement de stock pour le point de vente.\n"
+                "Vérifiez que le type d'opération du POS possède un entrepôt configuré (picking_type_id.warehouse_id)."
+            ))
+
+        return warehouse, location
+
+    @api.model
+    def _check_pos_orders_stock_availability(self, orders):
+        """Vérifie le stock d'un lot de commandes POS (données JSON) sans lever d'erreur.
+
+        Les commandes sont regroupées par session : l'emplacement est résolu une
+        fois par session et la disponibilité chargée en une requête pour tous les
+        produits concernés. Les commandes sont ensuite évaluées dans l'ordre de la
+        file, le stock d'une commande acceptée étant décompté avant la suivante.
+
+        Retourne une liste de verdicts, un par commande, dans l'ordre reçu :
+        {'name', 'ok', 'insufficient_products'}.
+        """
+        with self.env['stock.prevention.metrics']._measure('pos') as stats:
+            verdicts = []
+            sessions = {}
+            for order in orders:
+                demand = self._get_pos_stock_demand(order)
+                stats['lines'] += len(order.get('lines', []))
+                verdict = {
+                    'name': order.get('name') or order.get('uuid'),
+                    'ok': True,
+                    'insufficient_products': [],
+                }
+                verdicts.append(verdict)
+                if demand:
                     # En Odoo 18, la clé standard dans le dict "order" est 'session_id'
-                    session = self.env['pos.session'].browse(order.get('session_id'))
-                    location = None
-                    
-                    if session and session.config_id and session.config_id.picking_type_id:
-                        picking_type = session.config_id.picking_type_id
-
-                        warehouse, location = self._get_stock_check_warehouse_location(session, picking_type)
-                        _logger.info(
-                            "POS STOCK PREVENTION DEBUG: session=%s config=%s picking_type=%s warehouse=%s lot_stock_id=%s",
-                            session.display_name,
-                            session.config_id.display_name,
-                            picking_type.display_name,
-                            warehouse.display_name if warehouse else None,
-                            warehouse.lot_stock_id.display_name if getattr(warehouse, 'lot_stock_id', False) else None,
-                        )
-
-                        if not warehouse or not warehouse.lot_stock_id:
-                            raise UserError(_(
-                                "Le type d'opération du POS %(picking_type)s n'a pas d'entrepôt ou d'emplacement de stock principal.\n"
-                                "Configurez warehouse_id et son lot_stock_id sur l'entrepôt lié au picking type."
-                            ) % {
-                                'picking_type': picking_type.display_name,
-                            })
+                    sessions.setdefault(order.get('session_id'), []).append((verdict, demand))
+
+            # Les sessions partageant un emplacement partagent aussi son stock
+            locations = {}
+            for session_id, session_orders in sessions.items():
+                session = self.env['pos.session'].browse(session_id)
+                warehouse, location = self._get_pos_session_stock_location(session)
+                locations.setdefault(location.id, [warehouse, location, []])[2].extend(session_orders)
+
+            # Mode strict : verrous de tous les emplacements pris en une passe, dans un ordre global
+            self.env['stock.quant']._lock_available_quantities(
+                self.env['product.product'].concat(*{
+                    product for session_orders in sessions.values() for verdict, demand in session_orders for product in demand
+                }),
+                self.env['stock.location'].concat(*(location for warehouse, location, session_orders in locations.values())),
+            )
+
+            for warehouse, location, session_orders in sorted(locations.values(), key=lambda group: group[1].id):
+                warehouse_name = warehouse.display_name if warehouse else None
+
+                # Une seule requête agrégée pour tous les produits des commandes de la session
+                products = self.env['product.product'].concat(*{
+                    product for verdict, demand in session_orders for product in demand
+                })
+                available_by_product = self._get_available_quantity_map(products, location)
+
+                for verdict, demand in session_orders:
+                    for product, (qty, line_refs) in demand.items():
+                        available_qty = available_by_product.get(product.id, 0.0)
+
+                        _logger.debug("POS STOCK PREVENTION: Produit %s - Demandé: %s, Disponible: %s", product.id, qty, available_qty)
 
-                        if warehouse and location:
-                            _logger.info(
-                                "POS STOCK PREVENTION: Utilisation entrepôt '%s' (emplacement: %s)"
-                                % (warehouse.display_name, location.display_name)
-                            )
-
-                    if not location:
-                        # Impossible de déterminer la localisation de stock du POS
-                        _logger.warning(
-                            "POS STOCK PREVENTION DEBUG: location introuvable pour session=%s, config=%s, picking_type=%s",
-                            session.display_name if 'session' in locals() else None,
-                            session.config_id.display_name if 'session' in locals() and session.config_id else None,
-                            session.config_id.picking_type_id.display_name if 'session' in locals() and session.config_id and session.config_id.picking_type_id else None,
-                        )
-                        raise UserError(_(
-                            "Impossible de déterminer l'emplacement de stock pour le point de vente.\n"
-                            "Vérifiez que le type d'opération du POS possède un entrepôt configuré (picking_type_id.warehouse_id)."
-                        ))
-                    
-                    if location:
-                        # Calculer la quantité disponible avec la méthode corrigée
-                        available_qty = self._get_available_quantity(product, location)
-                        
-                        _logger.info(f"POS STOCK PREVENTION: Produit {product.display_name} - Demandé: {qty}, Disponible: {available_qty}")
-                        
                         # Vérifier si la quantité demandée est disponible
                         if qty > available_qty:
-                            insufficient_products.append({
+                            verdict['insufficient_products'].append({
                                 'product': product,
                                 'available_qty': available_qty,
                                 'requested_qty': qty,
-                                'warehouse_name': warehouse.display_name if 'warehouse' in locals() and warehouse else None,
+                                'warehouse_name': warehouse_name,
+                                'lines': line_refs,
                             })
+
+                    if verdict['insufficient_products']:
+                        verdict['ok'] = False
+                    else:
+                        # Commande acceptée : son stock n'est plus disponible pour les suivantes
+                        for product, (qty, line_refs) in demand.items():
+                            available_by_product[product.id] = available_by_product.get(product.id, 0.0) - qty
+
+            stats['rejections'] = len([verdict for verdict in verdicts if not verdict['ok']])
+
+        return verdicts
+
+    def _check_pos_stock_availability(self, order):
+        """Vérifie la disponibilité du stock pour toutes les lignes de commande POS"""
+        verdict = self._check_pos_orders_stock_availability([order])[0]
         
         # Lever une erreur si des produits n'ont pas suffisamment de stock
-        if insufficient_products:
-            error_msg = _("Stock insuffisant pour les produits suivants :\n\n")
-            for product_info in insufficient_products:
-                error_msg += _("• %(product)s : Demandé %(requested).2f %(uom)s, Disponible %(available).2f %(uom)s dans l'entrepôt %(warehouse)s\n") % {
-                    'product': product_info['product'].display_name,
-                    'requested': product_info['requested_qty'],
-                    'available': product_info['available_qty'],
-                    'uom': product_info['product'].uom_id.name,
-                    'warehouse': product_info['warehouse_name'] or _('Inconnu'),
-                }
-            error_msg += _("\nVeuillez ajuster les quantités ou réapprovisionner le stock.")
+        if not verdict['ok']:
+            raise UserError(self._get_pos_stock_shortage_message(verdict['insufficient_products']))
 
-            raise UserError(error_msg)
+    @api.model
+    def _get_pos_stock_shortage_message(self, insufficient_products):
+        """Construit le message d'erreur pour une liste de produits en manque (limitée à
+        SHORTAGE_MESSAGE_MAX_PRODUCTS produits détaillés)"""
+        error_msg = _("Stock insuffisant pour les produits suivants :\n\n")
+        for product_info in insufficient_products[:SHORTAGE_MESSAGE_MAX_PRODUCTS]:
+            error_msg += _("• %(product)s : Demandé %(requested).2f %(uom)s, Disponible %(available).2f %(uom)s dans l'entrepôt %(warehouse)s (lignes %(lines)s)\n") % {
+                'product': product_info['product'].display_name,
+                'requested': product_info['requested_qty'],
+                'available': product_info['available_qty'],
+                'uom': product_info['product'].uom_id.name,
+                'warehouse': product_info['warehouse_name'] or _('Inconnu'),
+                'lines': ', '.join(str(position) for position in product_info['lines']),
+            }
+        if len(insufficient_products) > SHORTAGE_MESSAGE_MAX_PRODUCTS:
+            error_msg += _("… et %s autre(s) produit(s).\n") % (len(insufficient_products) - SHORTAGE_MESSAGE_MAX_PRODUCTS)
+        error_msg += _("\nVeuillez ajuster les quantités ou réapprovisionner le stock.")
+        return error_msg
 
 
 class PosOrderLine(models.Model):
@@ -155,86 +325,102 @@ class PosOrderLine(models.Model):
 
     @api.model_create_multi
     def create(self, vals_list):
-        """Override pour vérifier le stock lors de la création de ligne POS"""
-        # Vérifier si la prévention est activée (get_param retourne une string)
-        prevent_negative_param = self.env['ir.config_parameter'].sudo().get_param(
-            'stock_negative_prevention.prevent_pos', 'False'
-        )
-        prevent_negative = prevent_negative_param in ('True', 'true', '1', 'yes')
-        
-        if prevent_negative:
-            for vals in vals_list:
-                if vals.get('product_id') and vals.get('qty', 0) > 0:
-                    product = self.env['product.product'].browse(vals['product_id'])
-                    
-                    # Vérifier les produits stockables ET consommables (qui peuvent avoir du stock)
-                    if product.type in ('product', 'consu'):
-                        self._validate_pos_line_stock(product, vals.get('qty', 0))
+        """Override pour vérifier le stock lors de la création de ligne POS
+
+        Les lignes créées par _process_order (commande déjà vérifiée) portent le
+        contexte ``stock_prevention_skip_line_check`` et ne sont pas revérifiées.
+        """
+        if not self.env.context.get('stock_prevention_skip_line_check'):
+            self._validate_pos_lines_stock([
+                (vals['order_id'], vals['product_id'], vals['qty'], position)
+                for position, vals in enumerate(vals_list, start=1)
+                if vals.get('order_id') and vals.get('product_id') and vals.get('qty', 0) > 0
+            ])
         
         return super().create(vals_list)
 
     def write(self, vals):
         """Override pour vérifier le stock lors de la modification de ligne POS"""
-        # Vérifier si la prévention est activée (get_param retourne une string)
-        prevent_negative_param = self.env['ir.config_parameter'].sudo().get_param(
-            'stock_negative_prevention.prevent_pos', 'False'
-        )
-        prevent_negative = prevent_negative_param in ('True', 'true', '1', 'yes')
-        
-        if prevent_negative and 'qty' in vals:
-            for line in self:
-                # Vérifier les produits stockables ET consommables (qui peuvent avoir du stock)
-                if line.product_id.type in ('product', 'consu') and vals.get('qty', 0) > 0:
-                    self._validate_pos_line_stock(line.product_id, vals['qty'])
+        if vals.get('qty', 0) > 0 and not self.env.context.get('stock_prevention_skip_line_check'):
+            self._validate_pos_lines_stock([
+                (line.order_id.id, line.product_id.id, vals['qty'], position)
+                for position, line in enumerate(self, start=1)
+                if line.order_id
+            ])
         
         return super().write(vals)
 
     def _validate_pos_line_stock(self, product, qty):
         """Valide le stock pour une ligne POS spécifique"""
-        location = None
-        warehouse = None
-        
-        # Déterminer l'emplacement de stock
-        if hasattr(self, 'order_id') and self.order_id.session_id:
-            session = self.order_id.session_id
-            if session.config_id and session.config_id.picking_type_id:
-                picking_type = session.config_id.picking_type_id
-
-                warehouse, location = self.order_id._get_stock_check_warehouse_location(session, picking_type)
-                _logger.info(
-                    "POS STOCK PREVENTION DEBUG LINE: session=%s config=%s picking_type=%s warehouse=%s lot_stock_id=%s",
-                    session.display_name,
-                    session.config_id.display_name,
-                    picking_type.display_name,
-                    warehouse.display_name if warehouse else None,
-                    warehouse.lot_stock_id.display_name if getattr(warehouse, 'lot_stock_id', False) else None,
-                )
+        if self.order_id:
+            self._validate_pos_lines_stock([(self.order_id.id, product.id, qty, 1)])
 
-        # Si on n'a pas réussi à déterminer une localisation à ce niveau,
-        # on sort silencieusement : pas d'erreur de config ici.
-        if not location:
+    @api.model
+    def _validate_pos_lines_stock(self, line_demands):
+        """Valide le stock d'un lot de lignes POS.
+
+        line_demands : liste de (order_id, product_id, quantité, numéro de ligne).
+        Seules les lignes des points de vente où la prévention est active sont
+        vérifiées. La demande est regroupée par emplacement puis par produit, et
+        chaque emplacement coûte une seule requête de disponibilité.
+        """
+        if not line_demands:
             return
-        
-        if location:
-            # Calculer la quantité disponible avec la méthode corrigée
-            available_qty = self.order_id._get_available_quantity(product, location)
 
-            # Récupérer le nom de l'entrepôt associé au picking type, si possible
-            warehouse_name = None
-            if warehouse:
-                warehouse_name = warehouse.display_name
+        with self.env['stock.prevention.metrics']._measure('pos_line') as stats:
+            stats['lines'] = len(line_demands)
+            PosOrder = self.env['pos.order']
+            orders = PosOrder.browse({order_id for order_id, product_id, qty, line_ref in line_demands})
+            products = self.env['product.product'].browse({product_id for order_id, product_id, qty, line_ref in line_demands})
 
-            # Vérifier si la quantité demandée est disponible
-            if qty > available_qty:
-                raise UserError(_(
-                    "Stock insuffisant pour %(product)s dans l'entrepôt %(warehouse)s.\n"
-                    "Quantité demandée : %(requested).2f %(uom)s\n"
-                    "Quantité disponible : %(available).2f %(uom)s\n\n"
-                    "Veuillez ajuster la quantité ou réapprovisionner le stock."
-                ) % {
-                    'product': product.display_name,
-                    'warehouse': warehouse_name or _('Inconnu'),
-                    'requested': qty,
-                    'available': available_qty,
-                    'uom': product.uom_id.name,
-                })
+            # Paramètres et emplacement de stock de chaque commande (résolutions mises en cache par session)
+            order_settings = {}
+            order_locations = {}
+            for order in orders:
+                if order.session_id:
+                    settings = PosOrder._get_pos_stock_prevention_settings(order.session_id.id)
+                    if settings['pos']:
+                        order_settings[order.id] = settings
+                        order_locations[order.id] = PosOrder._get_session_stock_check_warehouse_location(order.session_id)
+            Company = self.env['res.company']
+
+            demand_by_location = {}
+            for order_id, product_id, qty, line_ref in line_demands:
+                warehouse, location = order_locations.get(order_id, (None, None))
+                # Si on n'a pas réussi à déterminer une localisation à ce niveau,
+                # on ignore la ligne : pas d'erreur de config ici.
+                if not location:
+                    continue
+                product = self.env['product.product'].browse(product_id).with_prefetch(products._prefetch_ids)
+                if not Company._is_stock_checked_product(order_settings[order_id], product):
+                    continue
+                location_demand = demand_by_location.setdefault(location.id, [warehouse, location, {}])[2]
+                product_demand = location_demand.setdefault(product, [0.0, []])
+                product_demand[0] += qty
+                product_demand[1].append(line_ref)
+
+            insufficient_products = []
+            # Mode strict : verrous de tous les emplacements pris en une passe, dans un ordre global
+            self.env['stock.quant']._lock_available_quantities(
+                self.env['product.product'].concat(*{
+                    product for warehouse, location, demand in demand_by_location.values() for product in demand
+                }),
+                self.env['stock.location'].concat(*(location for warehouse, location, demand in demand_by_location.values())),
+            )
+            for warehouse, location, demand in sorted(demand_by_location.values(), key=lambda group: group[1].id):
+                products = self.env['product.product'].concat(*demand)
+                available_by_product = PosOrder._get_available_quantity_map(products, location)
+                for product, (qty, line_refs) in demand.items():
+                    available_qty = available_by_product.get(product.id, 0.0)
+                    # Vérifier si la quantité demandée est disponible
+                    if qty > available_qty:
+                        insufficient_products.append({
+                            'product': product,
+                            'available_qty': available_qty,
+                            'requested_qty': qty,
+                            'warehouse_name': warehouse.display_name if warehouse else None,
+                            'lines': line_refs,
+                        })
+
+            if insufficient_products:
+                raise UserError(PosOrder._get_pos_stock_shortage_message(insufficient_products))
@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from odoo import fields, models
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Les écritures d'une transaction portent l'horodatage de son début : une transaction
+# longue peut être validée après qu'une version plus récente a été envoyée au client.
+SNAPSHOT_DELTA_MARGIN = timedelta(minutes=1)
+
+
+class PosSession(models.Model):
+    _inherit = 'pos.session'
+
+    def get_stock_prevention_snapshot(self, version=None):
+        """RPC : disponibilité des produits du POS pour la vérification côté caisse.
+
+        Sans version, retourne la disponibilité de tous les produits stockables
+        disponibles au POS pour l'emplacement de la session. Avec la version d'un
+        envoi précédent, ne retourne que les produits dont les quants ont changé
+        depuis (mise à jour périodique).
+
+        Retourne {'enabled', 'version', 'full', 'quantities': {product_id: quantité}}.
+        """
+        self.ensure_one()
+        settings = self.env['pos.config']._get_stock_prevention_settings(self.config_id.id)
+        if not settings['pos']:
+            return {'enabled': False}
+        warehouse, location = self.env['pos.order']._get_session_stock_check_warehouse_location(self)
+        if not location:
+            return {'enabled': False}
+
+        StockQuant = self.env['stock.quant']
+        new_version = StockQuant._get_location_stock_version(location)
+        if version:
+            since = fields.Datetime.to_datetime(version) - SNAPSHOT_DELTA_MARGIN
+            products = self.env['product.product'].browse(StockQuant._get_changed_product_ids(location, since))
+        else:
+            products = self.env['product.product'].search([
+                ('available_in_pos', '=', True),
+                ('type', 'in', ('product', 'consu')),
+            ])
+        # Les produits exclus ne sont pas envoyés : la caisse ne les vérifie pas
+        Company = self.env['res.company']
+        products = products.filtered(lambda product: Company._is_stock_checked_product(settings, product))
+        available_by_product = StockQuant._get_available_quantity_map(products, location)
+        _logger.debug("POS STOCK PREVENTION: Instantané de %s produit(s) pour la session %s", len(available_by_product), self.id)
+        return {
+            'enabled': True,
+            'version': fields.Datetime.to_string(new_version) if new_version else False,
+            'full': not version,
+            'quantities': available_by_product,
+        }
@@ -0,0 +1,85 @@
+from odoo import api, fields, models, tools
+
+# Champs de res.company intervenant dans _get_stock_prevention_settings
+STOCK_PREVENTION_COMPANY_FIELDS = {
+    'prevent_negative_stock_sales',
+    'prevent_negative_stock_pos',
+    'stock_prevention_location_id',
+    'stock_prevention_excluded_product_ids',
+    'stock_prevention_excluded_categ_ids',
+}
+
+
+class ResCompany(models.Model):
+    _inherit = 'res.company'
+
+    prevent_negative_stock_sales = fields.Boolean(
+        string="Prévention Stock Négatif - Ventes",
+        help="Empêche la confirmation des commandes de vente si le stock est insuffisant"
+    )
+    prevent_negative_stock_pos = fields.Boolean(
+        string="Prévention Stock Négatif - Point de Vente",
+        help="Empêche la validation des commandes point de vente si le stock est insuffisant. "
+             "Chaque point de vente peut suivre ce réglage ou le remplacer."
+    )
+    stock_prevention_location_id = fields.Many2one(
+        'stock.location',
+        string="Emplacement de vérification (Ventes)",
+        domain="[('usage', '=', 'internal'), ('company_id', 'in', (id, False))]",
+        help="Si vide, le stock de l'entrepôt de la commande est vérifié."
+    )
+    stock_prevention_excluded_product_ids = fields.Many2many(
+        'product.product',
+        'res_company_stock_prevention_product_rel',
+        'company_id',
+        'product_id',
+        string="Produits exclus de la vérification",
+    )
+    stock_prevention_excluded_categ_ids = fields.Many2many(
+        'product.category',
+        'res_company_stock_prevention_categ_rel',
+        'company_id',
+        'categ_id',
+        string="Catégories exclues de la vérification",
+        help="Les sous-catégories sont également exclues."
+    )
+
+    def write(self, vals):
+        """Override pour invalider les paramètres de prévention mis en cache"""
+        res = super().write(vals)
+        if STOCK_PREVENTION_COMPANY_FIELDS & set(vals):
+            self.env.registry.clear_cache()
+        return res
+
+    @api.model
+    @tools.ormcache('company_id')
+    def _get_stock_prevention_settings(self, company_id):
+        """Paramètres de prévention d'une société, résolus une fois et mis en cache.
+
+        Retourne {'sales', 'pos', 'location_id', 'excluded_product_ids',
+        'excluded_categ_ids'} ; les résultats sont partagés, à ne pas modifier.
+        """
+        company = self.sudo().browse(company_id)
+        return {
+            'sales': company.prevent_negative_stock_sales,
+            'pos': company.prevent_negative_stock_pos,
+            'location_id': company.stock_prevention_location_id.id,
+            'excluded_product_ids': frozenset(company.stock_prevention_excluded_product_ids.ids),
+            'excluded_categ_ids': frozenset(company.stock_prevention_excluded_categ_ids.ids),
+        }
+
+    @api.model
+    def _is_stock_checked_product(self, settings, product):
+        """Indique si le stock du produit est vérifié selon les paramètres donnés"""
+        # Vérifier les produits stockables ET consommables (qui peuvent avoir du stock)
+        if product.type not in ('product', 'consu'):
+            return False
+        if product.id in settings['excluded_product_ids']:
+            return False
+        excluded_categ_ids = settings['excluded_categ_ids']
+        if excluded_categ_ids and product.categ_id:
+            # parent_path ("1/4/9/") couvre la catégorie et ses parents, sans requête
+            return excluded_categ_ids.isdisjoint(
+                int(categ_id) for categ_id in product.categ_id.parent_path.split('/') if categ_id
+            )
+        return True
@@ -1,4 +1,4 @@
-from odoo import api, fields, models
+from odoo import api, fields, models, tools
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -8,27 +8,143 @@ class ResConfigSettings(models.TransientModel):
     _inherit = 'res.config.settings'
 
     prevent_negative_stock_sales = fields.Boolean(
-        string="Prévention Stock Négatif - Ventes",
-        config_parameter='stock_negative_prevention.prevent_sales',
-        help="Empêche la confirmation des commandes de vente si le stock est insuffisant"
+        related='company_id.prevent_negative_stock_sales',
+        readonly=False,
     )
     
     prevent_negative_stock_pos = fields.Boolean(
-        string="Prévention Stock Négatif - Point de Vente",
-        config_parameter='stock_negative_prevention.prevent_pos',
-        help="Empêche la validation des commandes point de vente si le stock est insuffisant. "
-             "Utilise l'entrepôt défini dans la configuration du Point de Vente."
+        related='company_id.prevent_negative_stock_pos',
+        readonly=False,
     )
 
+    stock_prevention_location_id = fields.Many2one(
+        related='company_id.stock_prevention_location_id',
+        readonly=False,
+    )
+
+    stock_prevention_excluded_product_ids = fields.Many2many(
+        related='company_id.stock_prevention_excluded_product_ids',
+        readonly=False,
+    )
+
+    stock_prevention_excluded_categ_ids = fields.Many2many(
+        related='company_id.stock_prevention_excluded_categ_ids',
+        readonly=False,
+    )
+
+    pos_stock_prevention_pos = fields.Selection(
+        related='pos_config_id.stock_prevention_pos',
+        readonly=False,
+    )
+
+    pos_stock_prevention_location_id = fields.Many2one(
+        related='pos_config_id.stock_prevention_location_id',
+        readonly=False,
+    )
+
+    stock_prevention_use_snapshot = fields.Boolean(
+        string="Utiliser la table de disponibilité",
+        config_parameter='stock_negative_prevention.use_snapshot',
+        help="Lit la disponibilité dans une table maintenue par (produit, emplacement de stock "
+             "d'entrepôt) au lieu d'agréger les quants à chaque vérification."
+    )
+
+    stock_prevention_strict_locking = fields.Boolean(
+        string="Mode strict (verrouillage)",
+        config_parameter='stock_negative_prevention.strict_locking',
+        help="Verrouille les lignes de stock des produits vérifiés jusqu'à la fin de la confirmation, "
+             "afin que deux confirmations simultanées ne puissent pas consommer le même stock."
+    )
+
+    stock_prevention_lock_timeout = fields.Integer(
+        string="Attente maximale du verrou (ms)",
+        config_parameter='stock_negative_prevention.lock_timeout',
+        default=5000,
+        help="Au-delà de ce délai, la confirmation est refusée avec une invitation à réessayer."
+    )
+
+    stock_prevention_async_line_threshold = fields.Integer(
+        string="Vérification différée au-delà de (lignes)",
+        config_parameter='stock_negative_prevention.async_line_threshold',
+        default=0,
+        help="Les commandes ayant plus de lignes sont vérifiées (bouton « Vérifier Stock ») ou confirmées "
+             "(action « Confirmer (stock disponible) ») en arrière-plan par une tâche planifiée. 0 : jamais."
+    )
+
+    stock_prevention_check_mode = fields.Selection(
+        [
+            ('available', "Stock disponible"),
+            ('forecast', "Prévisionnel (date d'engagement)"),
+        ],
+        string="Mode de vérification des ventes",
+        config_parameter='stock_negative_prevention.check_mode',
+        default='available',
+        help="Prévisionnel : une commande avec une date d'engagement est acceptée si les réceptions "
+             "prévues d'ici là couvrent la demande, sans compromettre les livraisons déjà planifiées."
+    )
+
+    stock_prevention_metrics_token = fields.Char(
+        string="Jeton des métriques",
+        config_parameter='stock_negative_prevention.metrics_token',
+        help="Jeton attendu par /stock_negative_prevention/metrics (en-tête « Authorization: Bearer <jeton> »). "
+             "Vide : la route est désactivée."
+    )
+
+    stock_prevention_metrics_sample_rate = fields.Float(
+        string="Taux d'échantillonnage des mesures",
+        config_parameter='stock_negative_prevention.metrics_sample_rate',
+        default=1.0,
+        help="Part des vérifications dont la durée et les requêtes SQL sont mesurées (entre 0 et 1). "
+             "Le nombre de vérifications, de lignes et de rejets est toujours compté."
+    )
+
+    @api.model
+    @tools.ormcache()
+    def _get_stock_prevention_metrics_sample_rate(self):
+        """Taux d'échantillonnage des mesures de durée (entre 0 et 1), mis en cache"""
+        try:
+            rate = float(self.env['ir.config_parameter'].sudo().get_param(
+                'stock_negative_prevention.metrics_sample_rate', 1.0
+            ))
+        except ValueError:
+            return 1.0
+        return min(max(rate, 0.0), 1.0)
+
+    @api.model
+    @tools.ormcache()
+    def _get_stock_check_mode(self):
+        """Mode de vérification des ventes ('available' ou 'forecast'), mis en cache"""
+        return self.env['ir.config_parameter'].sudo().get_param(
+            'stock_negative_prevention.check_mode', 'available'
+        )
+
+    @api.model
+    @tools.ormcache('key')
+    def _get_stock_prevention_flag(self, key):
+        """Lit le paramètre technique booléen stock_negative_prevention.<key>.
+
+        Valeur mise en cache (ormcache) : les chemins critiques (confirmation,
+        onchange, synchronisation POS) ne relisent ni ne reparsent le paramètre.
+        Le cache est vidé par set_values et par ir.config_parameter.set_param.
+        """
+        # get_param retourne une string, pas un boolean
+        param = self.env['ir.config_parameter'].sudo().get_param(
+            f'stock_negative_prevention.{key}', 'False'
+        )
+        return param in ('True', 'true', '1', 'yes')
+
     def set_values(self):
         """Override pour logger les valeurs sauvegardées"""
+        snapshot_was_used = self._get_stock_prevention_flag('use_snapshot')
         super().set_values()
-        _logger.info(f"STOCK PREVENTION CONFIG: prevent_sales={self.prevent_negative_stock_sales}")
-        _logger.info(f"STOCK PREVENTION CONFIG: prevent_pos={self.prevent_negative_stock_pos}")
-
-    @api.model
-    def get_values(self):
-        """Override pour logger les valeurs récupérées"""
-        res = super().get_values()
-        _logger.info(f"STOCK PREVENTION CONFIG GET: {res}")
-        return res
+        self.env.registry.clear_cache()
+        if self.stock_prevention_use_snapshot and not snapshot_was_used:
+            # La table n'est plus maintenue tant que l'option est désactivée
+            self.env['stock.available.snapshot']._rebuild()
+        _logger.info(
+            "STOCK PREVENTION CONFIG: prevent_sales=%s prevent_pos=%s use_snapshot=%s strict_locking=%s",
+            self.prevent_negative_stock_sales,
+            self.prevent_negative_stock_pos,
+            self.stock_prevention_use_snapshot,
+            self.stock_prevention_strict_locking,
+        )
@@ -1,156 +1,603 @@
-from odoo import api, fields, models, _
+import hashlib
+
+from odoo import api, fields, models, tools, _
 from odoo.exceptions import UserError
+from odoo.tools import plaintext2html
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# Durée (secondes) pendant laquelle les affichages indicatifs réutilisent une disponibilité lue
+LIVE_AVAILABILITY_TTL = 10
+
+# Nombre maximal de produits détaillés dans un message d'erreur (le rapport de manque est complet)
+SHORTAGE_MESSAGE_MAX_PRODUCTS = 20
+
 
 class SaleOrder(models.Model):
     _inherit = 'sale.order'
 
+    stock_prevention_enabled = fields.Boolean(
+        string="Prévention stock négatif active",
+        compute='_compute_stock_prevention_enabled',
+    )
+
+    stock_check_state = fields.Selection(
+        [
+            ('queued', "Vérification en file"),
+            ('ok', "Stock suffisant"),
+            ('short', "Stock insuffisant"),
+        ],
+        string="Vérification du stock",
+        readonly=True,
+        copy=False,
+    )
+    stock_check_date = fields.Datetime(string="Date de vérification du stock", readonly=True, copy=False)
+    stock_shortage_report_id = fields.Many2one(
+        'stock.shortage.report',
+        string="Rapport de manque",
+        readonly=True,
+        copy=False,
+        help="Résultat de la dernière vérification du stock",
+    )
+
+    @api.depends('company_id')
+    def _compute_stock_prevention_enabled(self):
+        for order in self:
+            order.stock_prevention_enabled = order._get_stock_prevention_settings()['sales']
+
     def action_confirm(self):
-        """Override pour vérifier le stock avant confirmation"""
-        # Vérifier si la prévention est activée (get_param retourne une string, pas un boolean)
-        prevent_negative_param = self.env['ir.config_parameter'].sudo().get_param(
-            'stock_negative_prevention.prevent_sales', 'False'
-        )
-        prevent_negative = prevent_negative_param in ('True', 'true', '1', 'yes')
+        """Override pour vérifier le stock avant confirmation
+
+        Fonctionne sur un ensemble de commandes (vue liste, import, cron EDI).
+        Avec le contexte ``stock_prevention_confirm_available``, seules les
+        commandes couvertes par le stock sont confirmées, les autres restent
+        en devis avec un message dans leur historique.
+        """
+        # Paramètres de la société de chaque commande (multi-société)
+        checked_orders = self.filtered(lambda o: o._get_stock_prevention_settings()['sales'])
         
-        _logger.info(f"STOCK PREVENTION: prevent_negative_param={prevent_negative_param}, prevent_negative={prevent_negative}")
+        _logger.debug("STOCK PREVENTION: %s commande(s) sur %s à vérifier", len(checked_orders), len(self))
         
-        if prevent_negative:
-            _logger.info("STOCK PREVENTION: Vérification du stock activée")
-            self._check_stock_availability()
+        if checked_orders:
+            _logger.debug("STOCK PREVENTION: Vérification du stock activée")
+            async_orders = checked_orders._get_stock_check_async_orders() if self.env.context.get('stock_prevention_async') else self.browse()
+            if async_orders:
+                # Confirmation différée des seules commandes au-delà du seuil, les autres sont traitées ici
+                self.env['stock.prevention.check.queue']._enqueue(async_orders, confirm=True)
+                if self - async_orders:
+                    (self - async_orders).action_confirm()
+                return async_orders._get_stock_check_queued_notification()
+            if self.env.context.get('stock_prevention_confirm_available'):
+                rejected, splits = checked_orders._reject_orders_without_stock()
+                orders = self - rejected
+                if not orders:
+                    return True
+                res = super(SaleOrder, orders).action_confirm()
+                orders._post_stock_split(splits)
+                return res
+            splits = checked_orders._check_stock_availability()
+            res = super().action_confirm()
+            checked_orders._post_stock_split(splits)
+            return res
         else:
-            _logger.info("STOCK PREVENTION: Vérification du stock désactivée")
+            _logger.debug("STOCK PREVENTION: Vérification du stock désactivée")
         
         return super().action_confirm()
 
+    def _get_stock_check_async_orders(self):
+        """Commandes dont la vérification doit passer par la file différée
+        (nombre de lignes de la commande au-delà du seuil stock_negative_prevention.async_line_threshold)"""
+        threshold = int(self.env['ir.config_parameter'].sudo().get_param(
+            'stock_negative_prevention.async_line_threshold', 0
+        ))
+        if not threshold:
+            return self.browse()
+        return self.filtered(lambda order: len(order.order_line) > threshold)
+
+    def _get_stock_check_queued_message(self):
+        return _("La vérification du stock de %s commande(s) a été placée en file d'attente. "
+                 "Vous serez notifié à la fin du traitement.") % len(self)
+
+    def _get_stock_check_queued_notification(self):
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Vérification Stock'),
+                'message': self._get_stock_check_queued_message(),
+                'type': 'info',
+                'sticky': False,
+            }
+        }
+
+    def action_confirm_available(self):
+        """Confirme uniquement les commandes dont le stock est suffisant"""
+        return self.with_context(stock_prevention_confirm_available=True).action_confirm()
+
     def _get_available_quantity(self, product, location):
         """Récupère la quantité disponible d'un produit dans un emplacement
         Méthode inspirée du module mrp_stock_validation pour un calcul correct"""
-        quants = self.env['stock.quant'].search([
-            ('product_id', '=', product.id),
-            ('location_id', 'child_of', location.id),
-        ])
-        available_qty = sum(quants.mapped('available_quantity'))
-        _logger.info(f"STOCK PREVENTION: Calcul stock pour {product.display_name} dans {location.name}: {available_qty}")
-        return available_qty
+        return self._get_available_quantity_map(product, location).get(product.id, 0.0)
+
+    def _get_available_quantity_map(self, products, location):
+        """Récupère les quantités disponibles de plusieurs produits en une requête"""
+        available = self.env['stock.quant']._get_available_quantity_map(products, location)
+        _logger.debug("STOCK PREVENTION: Calcul stock pour %s produit(s) dans l'emplacement %s", len(available), location.id)
+        return available
+
+    def _get_live_available_quantity_map(self, products, location):
+        """Disponibilité pour les affichages indicatifs, mise en cache quelques secondes"""
+        return self.env['stock.quant']._get_cached_available_quantity_map(products, location, LIVE_AVAILABILITY_TTL)
+
+    def _get_live_stock_check_quantity_map(self, products):
+        """Disponibilité indicative cumulée sur les entrepôts sources de la commande"""
+        self.ensure_one()
+        available = dict.fromkeys(products.ids, 0.0)
+        sources = self._get_stock_check_sources()
+        for warehouse, location in sources:
+            for product_id, available_qty in self._get_live_available_quantity_map(products, location).items():
+                # Un entrepôt en négatif ne réduit pas le stock des autres
+                available[product_id] += max(available_qty, 0.0) if len(sources) > 1 else available_qty
+        return available
+
+    def _get_stock_prevention_settings(self):
+        """Paramètres de prévention de la société de la commande (mis en cache, voir res.company)"""
+        return self.env['res.company']._get_stock_prevention_settings((self.company_id or self.env.company).id)
+
+    @api.model
+    @tools.ormcache('company_id')
+    def _get_default_stock_check_warehouse_id(self, company_id):
+        """Entrepôt par défaut de la société, mis en cache (vidé par stock.warehouse).
+
+        Recherche en sudo : le cache est partagé par tous les utilisateurs.
+        """
+        return self.env['stock.warehouse'].sudo().search([
+            ('company_id', '=', company_id)
+        ], limit=1).id
 
     def _get_stock_check_warehouse_location(self):
+        location_id = self._get_stock_prevention_settings()['location_id']
+        if location_id:
+            # Emplacement de vérification configuré sur la société
+            location = self.env['stock.location'].browse(location_id)
+            return location.warehouse_id, location
         warehouse = self.warehouse_id
         if not warehouse:
-            warehouse = self.env['stock.warehouse'].search([
-                ('company_id', '=', self.company_id.id)
-            ], limit=1)
+            warehouse = self.env['stock.warehouse'].browse(
+                self._get_default_stock_check_warehouse_id(self.company_id.id)
+            )
         location = warehouse.lot_stock_id if warehouse else None
         return warehouse, location
 
-    def _check_stock_availability(self):
-        """Vérifie la disponibilité du stock pour toutes les lignes de commande"""
-        insufficient_products = []
-        warehouse, location = self._get_stock_check_warehouse_location()
-        warehouse_name = warehouse.display_name if warehouse else None
-        
-        for line in self.order_line:
-            _logger.info(f"STOCK PREVENTION: Vérification ligne - Produit: {line.product_id.display_name}, Type: {line.product_id.type}, Qty: {line.product_uom_qty}")
-            
+    def _get_stock_check_sources(self):
+        """Couples (entrepôt, emplacement) pouvant servir la commande, dans l'ordre d'allocation.
+
+        Sans politique d'approvisionnement (stock.prevention.source), seul
+        l'entrepôt de la commande est vérifié. Avec une politique, ses entrepôts
+        sont utilisés dans l'ordre de la séquence, l'entrepôt de la commande en
+        tête s'il en fait partie.
+        """
+        self.ensure_one()
+        warehouse_ids = self.env['stock.prevention.source']._get_sourcing_warehouse_ids(
+            self.company_id.id, self.team_id.id,
+        )
+        if not warehouse_ids:
+            warehouse, location = self._get_stock_check_warehouse_location()
+            return [(warehouse, location)] if location else []
+        warehouses = self.env['stock.warehouse'].browse(warehouse_ids)
+        if self.warehouse_id in warehouses:
+            warehouses = self.warehouse_id | warehouses
+        return [(warehouse, warehouse.lot_stock_id) for warehouse in warehouses if warehouse.lot_stock_id]
+
+    def _get_stock_check_priority(self):
+        """Clé d'allocation du stock entre commandes d'un même lot"""
+        return (self.commitment_date or self.date_order, self.id)
+
+    def _get_stock_check_date(self):
+        """Date à laquelle le stock doit être disponible en mode prévisionnel (vide : maintenant)"""
+        return self.commitment_date
+
+    def _get_stock_shortages(self):
+        """Calcule les manques de stock pour un ensemble de commandes.
+
+        Retourne {order_id: [infos des produits manquants]} (voir _get_stock_allocation).
+        """
+        return self._get_stock_allocation()[0]
+
+    def _get_stock_allocation(self, sequential=True, inputs=None):
+        """Alloue le stock des entrepôts sources aux commandes, par priorité, sur un état du stock partagé.
+
+        Avec sequential=False, chaque commande est évaluée sur le stock complet.
+        Retourne (manques, répartitions entre entrepôts) ; inputs : voir _get_stock_check_inputs.
+        """
+        with self.env['stock.prevention.metrics']._measure('sale') as stats:
+            forecast = self.env['res.config.settings']._get_stock_check_mode() == 'forecast'
+            shortages = {}
+            splits = {}
+            inputs = inputs or self._get_stock_check_inputs()
+            # Un seul état du stock pour toutes les commandes : deux commandes dont les
+            # entrepôts sources se recouvrent puisent dans les mêmes quantités
+            locations = self.env['stock.location'].concat(*{
+                location for sources, demand in inputs.values() for warehouse, location in sources
+            }).sorted('id')
             # Vérifier les produits stockables ET consommables (qui peuvent avoir du stock)
-            if line.product_id.type in ('product', 'consu'):
-                # Utiliser l'emplacement par défaut de l'entrepôt de l'entreprise
-                _logger.info(f"STOCK PREVENTION: Utilisation entrepôt: {warehouse.name if warehouse else 'Aucun'}")
-                
-                if location:
-                    # Calculer la quantité disponible avec la méthode corrigée
-                    available_qty = self._get_available_quantity(line.product_id, location)
-                    requested_qty = line.product_uom._compute_quantity(
-                        line.product_uom_qty,
-                        line.product_id.uom_id,
-                    )
-                    
-                    _logger.info(
-                        f"STOCK PREVENTION: Produit {line.product_id.display_name} - Demandé: {requested_qty} ({line.product_id.uom_id.name}), Disponible: {available_qty} ({line.product_id.uom_id.name})"
+            stock_lines = self.order_line.filtered(lambda l: l.product_id.type in ('product', 'consu'))
+            stats['lines'] += len(stock_lines)
+            _logger.debug("STOCK PREVENTION: Utilisation de %s emplacement(s) pour %s commande(s)", len(locations), len(self))
+
+            # Mode strict : verrous pris en une passe, dans un ordre global
+            # (voir StockQuant._lock_available_quantities)
+            self.env['stock.quant']._lock_available_quantities(stock_lines.product_id, locations)
+            timelines = self.env['stock.quant']._get_availability_timelines_multi(
+                stock_lines.product_id, locations, forecast=forecast,
+            ) if locations else {}
+
+            for order in self.sorted(lambda o: o._get_stock_check_priority()):
+                sources, demand = inputs[order]
+                if not sources:
+                    _logger.warning("STOCK PREVENTION: Aucun emplacement trouvé pour vérifier le stock")
+                    continue
+                warehouse_name = ', '.join(warehouse.display_name or location.display_name for warehouse, location in sources)
+                insufficient_products = []
+                allocation = []
+                check_date = order._get_stock_check_date() if forecast else None
+                for product, (requested_qty, line_refs) in demand.items():
+                    location_quantities = [
+                        (warehouse, location, timelines[location.id][product.id].available_at(check_date))
+                        for warehouse, location in sources
+                    ]
+                    if len(sources) > 1:
+                        # Un entrepôt en négatif ne réduit pas le stock des autres
+                        available_qty = sum(max(quantity, 0.0) for warehouse, location, quantity in location_quantities)
+                    else:
+                        available_qty = location_quantities[0][2]
+
+                    _logger.debug(
+                        "STOCK PREVENTION: Produit %s - Demandé: %s, Disponible: %s", product.id, requested_qty, available_qty,
                     )
-                    
+
                     # Vérifier si la quantité demandée est disponible
                     if requested_qty > available_qty:
                         insufficient_products.append({
-                            'product': line.product_id.display_name,
+                            'product_id': product.id,
+                            'product': product.display_name,
                             'requested': requested_qty,
                             'available': available_qty,
-                            'uom': line.product_id.uom_id.name,
+                            'uom': product.uom_id.name,
                             'warehouse': warehouse_name,
+                            'location_id': sources[0][1].id,
+                            'lines': line_refs,
                         })
-                        _logger.warning(f"STOCK PREVENTION: Stock insuffisant pour {line.product_id.display_name}")
-                else:
-                    _logger.warning(f"STOCK PREVENTION: Aucun emplacement trouvé pour vérifier le stock")
-        
-        # Lever une erreur si des produits n'ont pas suffisamment de stock
-        if insufficient_products:
-            error_msg = _("Stock insuffisant pour les produits suivants :\n\n")
-            for product_info in insufficient_products:
-                error_msg += _("• %s : Demandé %.2f %s, Disponible %.2f %s dans l'entrepôt %s\n") % (
+                        _logger.debug("STOCK PREVENTION: Stock insuffisant pour le produit %s", product.id)
+                        continue
+
+                    # Répartition dans l'ordre des entrepôts sources
+                    remaining_qty = requested_qty
+                    product_split = []
+                    for warehouse, location, quantity in location_quantities:
+                        taken_qty = min(remaining_qty, max(quantity, 0.0)) if len(sources) > 1 else remaining_qty
+                        if taken_qty > 0:
+                            product_split.append((warehouse, location, taken_qty))
+                            remaining_qty -= taken_qty
+                        if remaining_qty <= 0:
+                            break
+                    allocation.append((product, product_split))
+
+                if insufficient_products:
+                    shortages[order.id] = insufficient_products
+                    continue
+                if sequential:
+                    # La commande est servie : son stock n'est plus disponible pour les suivantes
+                    for product, product_split in allocation:
+                        for warehouse, location, quantity in product_split:
+                            timelines[location.id][product.id].consume(quantity, check_date)
+                if len({warehouse for product, product_split in allocation for warehouse, location, quantity in product_split}) > 1:
+                    splits[order.id] = [
+                        (product, [(warehouse, quantity) for warehouse, location, quantity in product_split])
+                        for product, product_split in allocation
+                    ]
+
+            stats['rejections'] = len(shortages)
+
+        return shortages, splits
+
+    def _get_stock_check_inputs(self):
+        """Entrepôts sources et demande de chaque commande, calculés une fois : {order: (sources, demande)}"""
+        return {order: (order._get_stock_check_sources(), order._get_stock_demand()) for order in self}
+
+    def _get_stock_demand(self):
+        """Regroupe la demande de la commande par produit.
+
+        Les quantités sont converties dans l'unité du produit afin que plusieurs
+        lignes d'un même produit soient comparées ensemble au stock.
+        Retourne {product: [quantité demandée, numéros des lignes concernées]}.
+        """
+        self.ensure_one()
+        demand = {}
+        # Paramètres résolus une fois pour la commande (exclusions de produits et de catégories)
+        settings = self._get_stock_prevention_settings()
+        Company = self.env['res.company']
+        for position, line in enumerate(self.order_line, start=1):
+            if not Company._is_stock_checked_product(settings, line.product_id):
+                continue
+            _logger.debug("STOCK PREVENTION: Vérification ligne - Produit: %s, Qty: %s", line.product_id.id, line.product_uom_qty)
+            requested_qty = line.product_uom._compute_quantity(
+                line.product_uom_qty,
+                line.product_id.uom_id,
+            )
+            product_demand = demand.setdefault(line.product_id, [0.0, []])
+            product_demand[0] += requested_qty
+            product_demand[1].append(position)
+        return demand
+
+    def _get_stock_shortage_message(self, shortages):
+        """Construit le message d'erreur à partir du résultat de _get_stock_shortages.
+
+        Au-delà de SHORTAGE_MESSAGE_MAX_PRODUCTS produits, le message renvoie au
+        rapport de manque (bouton « Vérifier Stock ») au lieu de tout détailler.
+        """
+        error_msg = _("Stock insuffisant pour les produits suivants :\n\n")
+        remaining = SHORTAGE_MESSAGE_MAX_PRODUCTS
+        omitted = 0
+        for order in self.filtered(lambda o: o.id in shortages):
+            if remaining <= 0:
+                omitted += len(shortages[order.id])
+                continue
+            if len(self) > 1:
+                error_msg += _("Commande %s :\n") % order.name
+            omitted += max(len(shortages[order.id]) - remaining, 0)
+            for product_info in shortages[order.id][:remaining]:
+                remaining -= 1
+                error_msg += _("• %s : Demandé %.2f %s, Disponible %.2f %s dans l'entrepôt %s (lignes %s)\n") % (
                     product_info['product'],
                     product_info['requested'],
                     product_info['uom'],
                     product_info['available'],
                     product_info['uom'],
                     product_info['warehouse'] or _('Inconnu'),
+                    ', '.join(str(position) for position in product_info['lines']),
                 )
-            error_msg += _("\nVeuillez ajuster les quantités ou réapprovisionner le stock.")
-            
-            raise UserError(error_msg)
+        if omitted:
+            error_msg += _("… et %s autre(s) produit(s) : le bouton « Vérifier Stock » donne le rapport complet.\n") % omitted
+        error_msg += _("\nVeuillez ajuster les quantités ou réapprovisionner le stock.")
+        return error_msg
+
+    def _get_stock_split_message(self, splits):
+        """Décrit la répartition proposée entre entrepôts (résultat de _get_stock_allocation)"""
+        self.ensure_one()
+        message = _("Répartition proposée du stock :\n")
+        for product, product_split in splits[self.id]:
+            message += _("• %s : %s\n") % (
+                product.display_name,
+                ', '.join(
+                    _("%.2f %s depuis %s") % (quantity, product.uom_id.name, warehouse.display_name)
+                    for warehouse, quantity in product_split
+                ),
+            )
+        return message
+
+    def _post_stock_split(self, splits):
+        """Trace dans l'historique la répartition des commandes servies par plusieurs entrepôts"""
+        for order in self.filtered(lambda o: o.id in splits):
+            order.message_post(body=plaintext2html(order._get_stock_split_message(splits)))
+
+    def _get_stock_check_demand_key(self, sources, demand):
+        """Clé de la demande vérifiée : produits, quantités et lignes, entrepôts sources, mode et date"""
+        self.ensure_one()
+        forecast = self.env['res.config.settings']._get_stock_check_mode() == 'forecast'
+        demand = sorted(
+            (product.id, requested_qty, tuple(line_refs))
+            for product, (requested_qty, line_refs) in demand.items()
+        )
+        sources = [location.id for warehouse, location in sources]
+        check_date = str(self._get_stock_check_date()) if forecast else None
+        return hashlib.sha1(repr((demand, sources, forecast, check_date)).encode()).hexdigest()
+
+    def _get_stock_check_keys(self, inputs=None):
+        """Filigrane du stock et clé de la demande de chaque commande : {order_id: (filigrane, clé)}.
+
+        À calculer avant la vérification : un stock modifié pendant celle-ci
+        donne un autre filigrane à la vérification suivante.
+        """
+        forecast = self.env['res.config.settings']._get_stock_check_mode() == 'forecast'
+        inputs = inputs or self._get_stock_check_inputs()
+        keys = {}
+        for order in self:
+            sources, demand = inputs[order]
+            locations = self.env['stock.location'].concat(*(location for warehouse, location in sources))
+            products = self.env['product.product'].concat(*demand)
+            keys[order.id] = (
+                self.env['stock.quant']._get_stock_watermark(products, locations, forecast=forecast),
+                order._get_stock_check_demand_key(sources, demand),
+            )
+        return keys
+
+    def _store_stock_check_result(self, shortages, splits=None, keys=None):
+        """Enregistre le résultat d'une vérification dans un rapport de manque par commande.
+
+        Le rapport précédent de chaque commande est remplacé.
+        """
+        now = fields.Datetime.now()
+        previous_reports = self.stock_shortage_report_id
+        reports = self.env['stock.shortage.report'].sudo()._create_from_shortages(self, shortages, splits, keys)
+        for order in self:
+            order.write({
+                'stock_check_state': reports[order.id].state,
+                'stock_check_date': now,
+                'stock_shortage_report_id': reports[order.id].id,
+            })
+        previous_reports.sudo().unlink()
+        return reports
+
+    def _get_stock_shortage_report(self):
+        """Rapport de vérification de la commande, réutilisé si ni le stock ni la demande n'ont changé"""
+        self.ensure_one()
+        inputs = self._get_stock_check_inputs()
+        keys = self._get_stock_check_keys(inputs)
+        report = self.stock_shortage_report_id
+        if report and report.watermark and (report.watermark, report.demand_key) == keys[self.id]:
+            _logger.debug("STOCK PREVENTION: Rapport %s réutilisé pour la commande %s", report.id, self.id)
+            return report
+        shortages, splits = self._get_stock_allocation(inputs=inputs)
+        return self._store_stock_check_result(shortages, splits, keys)[self.id]
+
+    def _check_stock_availability(self):
+        """Vérifie la disponibilité du stock pour toutes les lignes des commandes.
+
+        Retourne les répartitions entre entrepôts (voir _get_stock_allocation).
+        """
+        shortages, splits = self._get_stock_allocation()
+        
+        # Lever une erreur si des produits n'ont pas suffisamment de stock
+        if shortages:
+            raise UserError(self._get_stock_shortage_message(shortages))
+        return splits
+
+    def _reject_orders_without_stock(self):
+        """Retourne les commandes sans stock suffisant, en traçant le refus sur chacune,
+        et les répartitions entre entrepôts des autres commandes."""
+        shortages, splits = self._get_stock_allocation()
+        self._store_stock_check_result(shortages, splits)
+        rejected = self.filtered(lambda o: o.id in shortages)
+        for order in rejected:
+            _logger.info("STOCK PREVENTION: Commande %s non confirmée, stock insuffisant", order.name)
+            order.message_post(body=plaintext2html(order._get_stock_shortage_message(shortages)))
+        return rejected, splits
 
     def action_check_stock_availability(self):
-        """Action pour vérifier manuellement la disponibilité du stock"""
+        """Action pour vérifier manuellement la disponibilité du stock
+
+        Les commandes au-delà du seuil de lignes configuré sont placées dans
+        la file différée (stock.prevention.check.queue), les autres sont
+        vérifiées immédiatement.
+        """
+        async_orders = self._get_stock_check_async_orders()
+        if async_orders:
+            self.env['stock.prevention.check.queue']._enqueue(async_orders)
+            if async_orders == self:
+                return async_orders._get_stock_check_queued_notification()
         try:
-            self._check_stock_availability()
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': _('Vérification Stock'),
-                    'message': _('Stock suffisant pour tous les produits de cette commande.'),
-                    'type': 'success',
-                    'sticky': False,
-                }
-            }
+            reports = self.env['stock.shortage.report'].concat(*(
+                order._get_stock_shortage_report() for order in self - async_orders
+            ))
         except UserError as e:
+            # Verrou non obtenu en mode strict, configuration incomplète
             return {
                 'type': 'ir.actions.client',
                 'tag': 'display_notification',
                 'params': {
-                    'title': _('Stock Insuffisant'),
+                    'title': _('Vérification Stock'),
                     'message': str(e),
                     'type': 'warning',
                     'sticky': True,
                 }
             }
+        short_reports = reports.filtered(lambda report: report.state == 'short')
+        if len(short_reports) == 1:
+            return short_reports.action_open()
+        if short_reports:
+            return {
+                'type': 'ir.actions.act_window',
+                'name': _('Stock Insuffisant'),
+                'res_model': 'stock.shortage.report',
+                'domain': [('id', 'in', short_reports.ids)],
+                'view_mode': 'list,form',
+            }
+        message = _('Stock suffisant pour tous les produits de cette commande.')
+        for report in reports.filtered('split_note'):
+            message += '\n' + report.split_note
+        if async_orders:
+            message += '\n' + async_orders._get_stock_check_queued_message()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Vérification Stock'),
+                'message': message,
+                'type': 'success',
+                'sticky': False,
+            }
+        }
 
 
 class SaleOrderLine(models.Model):
     _inherit = 'sale.order.line'
 
+    stock_prevention_available_qty = fields.Float(
+        string="Disponible",
+        compute='_compute_stock_prevention_available_qty',
+        digits='Product Unit of Measure',
+        help="Quantité disponible dans l'emplacement de vérification, exprimée dans l'unité de la ligne",
+    )
+    stock_prevention_short = fields.Boolean(
+        string="Stock insuffisant",
+        compute='_compute_stock_prevention_available_qty',
+        help="La demande totale du produit dans la commande (toutes lignes confondues) dépasse le stock disponible",
+    )
+
+    @api.depends(
+        'product_id', 'product_uom', 'product_uom_qty', 'order_id.order_line.product_uom_qty',
+        'order_id.state', 'order_id.warehouse_id', 'order_id.company_id', 'order_id.team_id',
+    )
+    def _compute_stock_prevention_available_qty(self):
+        """Une lecture (mise en cache quelques secondes) par liste d'entrepôts sources pour toutes les lignes.
+
+        Rien n'est lu pour les commandes confirmées ou annulées, ni quand la
+        prévention est désactivée pour la société de la commande.
+        """
+        self.stock_prevention_available_qty = 0.0
+        self.stock_prevention_short = False
+        Company = self.env['res.company']
+        order_sources = {}
+        for order in self.order_id:
+            settings = order._get_stock_prevention_settings()
+            if settings['sales'] and order.state in ('draft', 'sent'):
+                order_sources[order] = (
+                    settings,
+                    tuple(location.id for warehouse, location in order._get_stock_check_sources()),
+                )
+        lines_by_sources = {}
+        for line in self:
+            settings, sources = order_sources.get(line.order_id, (None, None))
+            if sources and Company._is_stock_checked_product(settings, line.product_id):
+                lines_by_sources.setdefault(sources, []).append(line)
+        for lines in lines_by_sources.values():
+            lines = self.env['sale.order.line'].concat(*lines)
+            available_by_product = lines.order_id[:1]._get_live_stock_check_quantity_map(lines.product_id)
+            # Demande cumulée par produit, comme à la confirmation
+            demand_by_order = {order: order._get_stock_demand() for order in lines.order_id}
+            for line in lines:
+                available_qty = available_by_product.get(line.product_id.id, 0.0)
+                line.stock_prevention_available_qty = line.product_id.uom_id._compute_quantity(
+                    available_qty,
+                    line.product_uom or line.product_id.uom_id,
+                )
+                requested_qty = demand_by_order[line.order_id].get(line.product_id, [0.0])[0]
+                line.stock_prevention_short = requested_qty > available_qty
+
     @api.onchange('product_uom_qty')
     def _onchange_product_uom_qty_stock_check(self):
         """Vérification en temps réel lors de la modification de la quantité"""
-        if self.product_id and self.product_id.type in ('product', 'consu'):
-            prevent_negative_param = self.env['ir.config_parameter'].sudo().get_param(
-                'stock_negative_prevention.prevent_sales', 'False'
-            )
-            prevent_negative = prevent_negative_param in ('True', 'true', '1', 'yes')
+        settings = self.order_id._get_stock_prevention_settings()
+        if self.product_id and self.env['res.company']._is_stock_checked_product(settings, self.product_id):
+            prevent_negative = settings['sales']
             
             if prevent_negative and self.product_uom_qty > 0:
-                # Utiliser l'entrepôt par défaut de l'entreprise
-                warehouse, location = self.order_id._get_stock_check_warehouse_location()
-                warehouse_name = warehouse.display_name if warehouse else None
+                # Entrepôts sources de la commande (par défaut celui de la commande ou de l'entreprise)
+                sources = self.order_id._get_stock_check_sources()
+                warehouse_name = ', '.join(warehouse.display_name or location.display_name for warehouse, location in sources)
                 
-                if location:
-                    # Utiliser la méthode corrigée pour calculer le stock disponible
-                    available_qty = self.order_id._get_available_quantity(self.product_id, location)
-                    requested_qty = self.product_uom._compute_quantity(
-                        self.product_uom_qty,
-                        self.product_id.uom_id,
+                if sources:
+                    # Lecture mise en cache quelques secondes : l'onchange est déclenché à chaque saisie
+                    available_qty = self.order_id._get_live_stock_check_quantity_map(
+                        self.product_id,
+                    ).get(self.product_id.id, 0.0)
+                    # Cumuler les lignes du même produit, comme lors de la confirmation
+                    requested_qty = sum(
+                        line.product_uom._compute_quantity(line.product_uom_qty, line.product_id.uom_id)
+                        for line in self.order_id.order_line
+                        if line.product_id == self.product_id
                     )
                     
                     if requested_qty > available_qty:
@@ -0,0 +1,154 @@
+from odoo import api, fields, models, tools
+from odoo.tools.float_utils import float_compare
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class StockAvailableSnapshot(models.Model):
+    """Disponibilité matérialisée par (produit, emplacement de stock d'entrepôt).
+
+    Chaque ligne cumule les quants de l'emplacement suivi et de tous ses enfants.
+    Elle est mise à jour de façon incrémentale par les create/write/unlink de
+    stock.quant (voir StockQuant._update_available_snapshot), et vérifiée /
+    reconstruite par une tâche planifiée pour rattraper les écritures SQL
+    directes et les déplacements d'emplacements dans l'arborescence.
+    """
+    _name = 'stock.available.snapshot'
+    _description = 'Disponibilité matérialisée pour la prévention du stock négatif'
+    _log_access = False
+
+    product_id = fields.Many2one('product.product', string="Produit", required=True, index=True, ondelete='cascade')
+    location_id = fields.Many2one('stock.location', string="Emplacement", required=True, index=True, ondelete='cascade')
+    quantity = fields.Float(string="Quantité", digits='Product Unit of Measure', default=0.0)
+    reserved_quantity = fields.Float(string="Quantité réservée", digits='Product Unit of Measure', default=0.0)
+
+    _sql_constraints = [
+        ('product_location_uniq', 'unique(product_id, location_id)',
+         "Une seule ligne de disponibilité par produit et par emplacement."),
+    ]
+
+    @api.model
+    @tools.ormcache()
+    def _get_tracked_locations(self):
+        """Emplacements suivis : lot_stock_id des entrepôts, avec leur parent_path.
+
+        Le cache est vidé par stock.warehouse (create, unlink, changement de lot_stock_id).
+        """
+        warehouses = self.env['stock.warehouse'].sudo().with_context(active_test=False).search([])
+        return tuple(
+            (location.id, location.parent_path)
+            for location in warehouses.lot_stock_id
+        )
+
+    @api.model
+    def _is_tracked_location(self, location):
+        return location.id in {location_id for location_id, parent_path in self._get_tracked_locations()}
+
+    @api.model
+    def _get_available_quantity_map(self, products, location):
+        """Lecture directe de la disponibilité : une ligne par produit, sans parcours d'arborescence"""
+        available = dict.fromkeys(products.ids, 0.0)
+        self.env.cr.execute("""
+            SELECT product_id, quantity - reserved_quantity
+              FROM stock_available_snapshot
+             WHERE location_id = %s
+               AND product_id IN %s
+        """, (location.id, tuple(products.ids)))
+        available.update(self.env.cr.fetchall())
+        return available
+
+    @api.model
+    def _apply_deltas(self, deltas):
+        """Applique des variations {(product_id, location_id): [quantité, réservé]} par upsert"""
+        rows = [
+            (product_id, location_id, quantity, reserved_quantity)
+            for (product_id, location_id), (quantity, reserved_quantity) in deltas.items()
+            if quantity or reserved_quantity
+        ]
+        if not rows:
+            return
+        # Ordre déterministe pour éviter les interblocages entre transactions concurrentes
+        rows.sort()
+        self.env.cr.execute("""
+            INSERT INTO stock_available_snapshot (product_id, location_id, quantity, reserved_quantity)
+            VALUES %s
+            ON CONFLICT (product_id, location_id) DO UPDATE
+               SET quantity = stock_available_snapshot.quantity + EXCLUDED.quantity,
+                   reserved_quantity = stock_available_snapshot.reserved_quantity + EXCLUDED.reserved_quantity
+        """ % ", ".join(["(%s, %s, %s, %s)"] * len(rows)), [value for row in rows for value in row])
+        self.invalidate_model(['quantity', 'reserved_quantity'])
+
+    @api.model
+    def _get_quant_aggregate_query(self, location_ids):
+        """Requête SQL agrégeant les quants par (produit, emplacement suivi)"""
+        return """
+            SELECT quant.product_id, root.id, SUM(quant.quantity), SUM(quant.reserved_quantity)
+              FROM stock_quant quant
+              JOIN stock_location location ON location.id = quant.location_id
+              JOIN stock_location root ON location.parent_path LIKE root.parent_path || '%%'
+             WHERE root.id IN %s
+          GROUP BY quant.product_id, root.id
+        """, (tuple(location_ids),)
+
+    @api.model
+    def _rebuild(self, locations=None):
+        """Reconstruit la table à partir des quants, pour les emplacements donnés ou tous"""
+        location_ids = locations.ids if locations else [location_id for location_id, parent_path in self._get_tracked_locations()]
+        if not location_ids:
+            return
+        self.env.cr.execute("DELETE FROM stock_available_snapshot WHERE location_id IN %s", (tuple(location_ids),))
+        self.env['stock.quant'].flush_model(['product_id', 'location_id', 'quantity', 'reserved_quantity'])
+        query, params = self._get_quant_aggregate_query(location_ids)
+        self.env.cr.execute(f"""
+            INSERT INTO stock_available_snapshot (product_id, location_id, quantity, reserved_quantity)
+            {query}
+        """, params)
+        self.invalidate_model()
+        _logger.info("STOCK PREVENTION SNAPSHOT: Table reconstruite pour %s emplacement(s)", len(location_ids))
+
+    @api.model
+    def _verify(self):
+        """Compare la table aux quants et retourne la liste des écarts
+        [(product_id, location_id, quantité table, quantité quants)]."""
+        location_ids = [location_id for location_id, parent_path in self._get_tracked_locations()]
+        if not location_ids:
+            return []
+        self.env['stock.quant'].flush_model(['product_id', 'location_id', 'quantity', 'reserved_quantity'])
+        query, params = self._get_quant_aggregate_query(location_ids)
+        self.env.cr.execute(query, params)
+        expected = {
+            (product_id, location_id): (quantity, reserved_quantity)
+            for product_id, location_id, quantity, reserved_quantity in self.env.cr.fetchall()
+        }
+        self.env.cr.execute("""
+            SELECT product_id, location_id, quantity, reserved_quantity
+              FROM stock_available_snapshot
+             WHERE location_id IN %s
+        """, (tuple(location_ids),))
+        actual = {
+            (product_id, location_id): (quantity, reserved_quantity)
+            for product_id, location_id, quantity, reserved_quantity in self.env.cr.fetchall()
+        }
+        mismatches = []
+        for key in expected.keys() | actual.keys():
+            expected_qty, expected_reserved = expected.get(key, (0.0, 0.0))
+            actual_qty, actual_reserved = actual.get(key, (0.0, 0.0))
+            if (
+                float_compare(expected_qty, actual_qty, precision_digits=4)
+                or float_compare(expected_reserved, actual_reserved, precision_digits=4)
+            ):
+                mismatches.append((key[0], key[1], actual_qty - actual_reserved, expected_qty - expected_reserved))
+        return mismatches
+
+    @api.model
+    def _cron_verify_snapshot(self):
+        """Tâche planifiée : vérifie la table et la reconstruit en cas d'écart"""
+        if not self.env['res.config.settings']._get_stock_prevention_flag('use_snapshot'):
+            return
+        mismatches = self._verify()
+        if mismatches:
+            _logger.warning(
+                "STOCK PREVENTION SNAPSHOT: %s écart(s) détecté(s), reconstruction de la table", len(mismatches),
+            )
+            self._rebuild()
@@ -0,0 +1,73 @@
+from odoo import api, models, tools
+
+
+class StockLocation(models.Model):
+    _inherit = 'stock.location'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Override pour invalider les sous-arborescences mises en cache"""
+        locations = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return locations
+
+    def write(self, vals):
+        """Override pour mettre à jour la table de disponibilité si l'arborescence change.
+
+        Seuls les emplacements suivis qui contenaient ou contiennent désormais
+        les emplacements déplacés sont reconstruits.
+        """
+        if 'location_id' not in vals:
+            return super().write(vals)
+        use_snapshot = self.env['res.config.settings']._get_stock_prevention_flag('use_snapshot')
+        affected_ids = self._get_snapshot_root_ids() if use_snapshot else set()
+        res = super().write(vals)
+        self.env.registry.clear_cache()
+        if use_snapshot:
+            self.invalidate_recordset(['parent_path'])
+            affected_ids |= self._get_snapshot_root_ids()
+            if affected_ids:
+                self.env['stock.available.snapshot']._rebuild(self.browse(sorted(affected_ids)))
+        return res
+
+    def _get_snapshot_root_ids(self):
+        """Emplacements suivis par la table de disponibilité dont ces emplacements sont descendants"""
+        paths = [location.parent_path or '' for location in self]
+        return {
+            root_id
+            for root_id, root_path in self.env['stock.available.snapshot']._get_tracked_locations()
+            if root_id not in self.ids and any(path.startswith(root_path) for path in paths)
+        }
+
+    def unlink(self):
+        """Override pour invalider les sous-arborescences mises en cache"""
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
+
+    @api.model
+    @tools.ormcache('location_id')
+    def _get_stock_check_subtree_ids(self, location_id):
+        """Identifiants de l'emplacement et de tous ses descendants, mis en cache.
+
+        Remplace la résolution de child_of (recherche parent_path LIKE) répétée à
+        chaque vérification : les requêtes sur les quants filtrent ensuite
+        directement location_id sur cette liste. Le cache est vidé quand la
+        hiérarchie change (create, unlink, modification du parent).
+        """
+        location = self.browse(location_id)
+        self.flush_model(['parent_path'])
+        self.env.cr.execute("""
+            SELECT id
+              FROM stock_location
+             WHERE parent_path LIKE %s
+          ORDER BY id
+        """, (f'{location.sudo().parent_path}%',))
+        return tuple(location_id for location_id, in self.env.cr.fetchall())
+
+    def _get_stock_check_subtree_id_list(self):
+        """Liste des identifiants de la sous-arborescence de ces emplacements (paramètre SQL = ANY)"""
+        subtree_ids = set()
+        for location in self:
+            subtree_ids.update(self._get_stock_check_subtree_ids(location.id))
+        return sorted(subtree_ids)
@@ -0,0 +1,12 @@
+from odoo import models
+
+
+class StockPickingType(models.Model):
+    _inherit = 'stock.picking.type'
+
+    def write(self, vals):
+        """Override pour invalider l'emplacement de vérification POS mis en cache"""
+        res = super().write(vals)
+        if {'warehouse_id', 'default_location_src_id'} & set(vals):
+            self.env.registry.clear_cache()
+        return res
@@ -0,0 +1,144 @@
+from odoo import api, fields, models, _
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Nombre d'entrées traitées par exécution de la tâche planifiée
+QUEUE_CHUNK_SIZE = 50
+
+
+class StockPreventionCheckQueue(models.Model):
+    """File des vérifications de stock différées.
+
+    Les commandes trop volumineuses pour être vérifiées pendant la requête HTTP
+    sont placées dans cette file, traitée par lots par une tâche planifiée :
+    le worker HTTP est libéré immédiatement, le résultat est enregistré sur la
+    commande et le demandeur est notifié à la fin du traitement.
+    """
+    _name = 'stock.prevention.check.queue'
+    _description = 'File des vérifications de stock différées'
+    _order = 'id'
+
+    order_id = fields.Many2one('sale.order', string="Commande", required=True, index=True, ondelete='cascade')
+    user_id = fields.Many2one('res.users', string="Demandeur", required=True, default=lambda self: self.env.user)
+    confirm = fields.Boolean(string="Confirmer si le stock est suffisant")
+    state = fields.Selection(
+        [
+            ('pending', "En attente"),
+            ('done', "Traitée"),
+            ('failed', "En échec"),
+        ],
+        string="État",
+        default='pending',
+        required=True,
+        index=True,
+    )
+    error = fields.Text(string="Erreur", readonly=True)
+
+    @api.model
+    def _enqueue(self, orders, confirm=False):
+        """Place les commandes dans la file (une entrée en attente par commande) et déclenche le traitement"""
+        queue = self.sudo()
+        pending = queue.search([('order_id', 'in', orders.ids), ('state', '=', 'pending')])
+        if confirm:
+            pending.confirm = True
+        new_orders = orders - pending.order_id
+        queue.create([{
+            'order_id': order.id,
+            'user_id': self.env.user.id,
+            'confirm': confirm,
+        } for order in new_orders])
+        orders.stock_check_state = 'queued'
+        self.env.ref('stock_negative_prevention.ir_cron_stock_prevention_check_queue').sudo()._trigger()
+        _logger.info("STOCK PREVENTION QUEUE: %s commande(s) placée(s) en file (confirmation=%s)", len(orders), confirm)
+
+    @api.model
+    def _cron_process_queue(self, chunk_size=QUEUE_CHUNK_SIZE):
+        """Tâche planifiée : traite un lot d'entrées en attente.
+
+        Les vérifications d'un lot partagent une seule lecture groupée du stock
+        (SaleOrder._get_stock_allocation) ; seules les confirmations se
+        décomptent le stock l'une l'autre. Le cron est relancé tant qu'il reste
+        des entrées en attente.
+        """
+        # SKIP LOCKED : plusieurs workers cron peuvent traiter la file en parallèle
+        self.env.cr.execute("""
+            SELECT id
+              FROM stock_prevention_check_queue
+             WHERE state = 'pending'
+          ORDER BY id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, (chunk_size,))
+        entries = self.browse([entry_id for entry_id, in self.env.cr.fetchall()])
+        if not entries:
+            return
+
+        to_check = entries.filtered(lambda entry: not entry.confirm and entry.order_id.state in ('draft', 'sent'))
+        to_confirm = entries.filtered(lambda entry: entry.confirm and entry.order_id.state in ('draft', 'sent'))
+        # Commandes confirmées ou annulées entre-temps : plus rien à vérifier
+        skipped = entries - to_check - to_confirm
+        skipped.state = 'done'
+        skipped.order_id.filtered(lambda order: order.stock_check_state == 'queued').stock_check_state = False
+        for batch, method in ((to_check, '_process_check'), (to_confirm, '_process_confirm')):
+            if not batch:
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    getattr(batch, method)()
+                batch.state = 'done'
+            except Exception as e:
+                _logger.exception("STOCK PREVENTION QUEUE: Échec du traitement de %s entrée(s)", len(batch))
+                batch.write({'state': 'failed', 'error': str(e)})
+                batch.order_id.stock_check_state = False
+        entries._notify_requesters()
+
+        remaining = self.search_count([('state', '=', 'pending')])
+        self.env['ir.cron']._notify_progress(done=len(entries), remaining=remaining)
+
+    def _process_check(self):
+        """Vérifie les commandes des entrées en une lecture groupée et enregistre leurs rapports.
+
+        Comme le bouton « Vérifier Stock », chaque commande est évaluée sur le stock
+        complet : des devis sans lien, seulement vérifiés, ne se disputent pas le stock.
+        """
+        orders = self.order_id
+        inputs = orders._get_stock_check_inputs()
+        keys = orders._get_stock_check_keys(inputs)
+        shortages, splits = orders._get_stock_allocation(sequential=False, inputs=inputs)
+        orders._store_stock_check_result(shortages, splits, keys)
+
+    def _process_confirm(self):
+        """Confirme les commandes couvertes par le stock ; les autres restent en devis avec leur rapport.
+
+        La confirmation est faite au nom de chaque demandeur (droits et auteur des messages).
+        """
+        for user in self.user_id:
+            orders = self.filtered(lambda entry: entry.user_id == user).order_id
+            orders.with_user(user).with_context(stock_prevention_confirm_available=True).action_confirm()
+
+    def _notify_requesters(self):
+        """Notifie chaque demandeur de la fin du traitement de ses commandes"""
+        for user in self.user_id:
+            entries = self.filtered(lambda entry: entry.user_id == user)
+            short = entries.order_id.filtered(lambda order: order.stock_check_state == 'short')
+            failed = entries.filtered(lambda entry: entry.state == 'failed')
+            if failed:
+                notification_type = 'danger'
+                message = _("Vérification du stock en échec pour %s commande(s) : %s") % (
+                    len(failed), ', '.join(failed.order_id.mapped('name')),
+                )
+            elif short:
+                notification_type = 'warning'
+                message = _("Stock insuffisant pour %s commande(s) sur %s : %s") % (
+                    len(short), len(entries), ', '.join(short.mapped('name')),
+                )
+            else:
+                notification_type = 'success'
+                message = _("Stock suffisant pour %s commande(s).") % len(entries)
+            user._bus_send('simple_notification', {
+                'type': notification_type,
+                'title': _('Vérification Stock'),
+                'message': message,
+                'sticky': bool(failed or short),
+            })
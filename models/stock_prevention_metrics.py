@@ -0,0 +1,129 @@
+from contextlib import contextmanager
+import random
+import threading
+import time
+
+from odoo import api, models, _
+from odoo.exceptions import AccessError, UserError
+
+# Bornes (secondes) de l'histogramme des durées de vérification
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Compteurs du processus, par type de vérification ('sale', 'pos', 'pos_line')
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def _new_check_metrics():
+    return {
+        'checks': 0,
+        'lines': 0,
+        'sampled': 0,
+        'queries': 0,
+        'rejections': 0,
+        'duration_sum': 0.0,
+        'duration_buckets': [0] * (len(DURATION_BUCKETS) + 1),
+    }
+
+
+class StockPreventionMetrics(models.AbstractModel):
+    """Instrumentation des vérifications de stock.
+
+    Les compteurs sont tenus en mémoire par processus (comme les caches ormcache) :
+    chaque worker expose les siens via get_metrics() ou la route
+    /stock_negative_prevention/metrics, à agréger par l'outil de collecte.
+
+    Les vérifications, lignes et rejets sont toujours comptés. La durée et le
+    nombre de requêtes SQL ne sont mesurés que sur un échantillon (paramètre
+    stock_negative_prevention.metrics_sample_rate) : l'histogramme et le total
+    des requêtes portent sur les vérifications échantillonnées.
+    """
+    _name = 'stock.prevention.metrics'
+    _description = 'Métriques de la prévention du stock négatif'
+
+    @api.model
+    @contextmanager
+    def _measure(self, check):
+        """Mesure une vérification : rejet (UserError) et, si elle est échantillonnée,
+        durée et requêtes SQL émises.
+
+        Le bloc peut renseigner stats['lines'] et stats['rejections'].
+        """
+        stats = {'lines': 0, 'rejections': 0}
+        sampled = random.random() < self.env['res.config.settings']._get_stock_prevention_metrics_sample_rate()
+        start = time.perf_counter()
+        queries_start = self.env.cr.sql_log_count
+        try:
+            yield stats
+        except UserError:
+            stats['rejections'] = stats['rejections'] or 1
+            raise
+        finally:
+            self._record(
+                check,
+                lines=stats['lines'],
+                rejections=stats['rejections'],
+                queries=self.env.cr.sql_log_count - queries_start if sampled else None,
+                duration=time.perf_counter() - start if sampled else None,
+            )
+
+    @api.model
+    def _record(self, check, lines, rejections, queries=None, duration=None):
+        """Ajoute une vérification aux compteurs ; queries et duration sont None hors échantillon"""
+        with _metrics_lock:
+            metrics = _metrics.setdefault(check, _new_check_metrics())
+            metrics['checks'] += 1
+            metrics['lines'] += lines
+            metrics['rejections'] += rejections
+            if duration is not None:
+                bucket = next(
+                    (index for index, bound in enumerate(DURATION_BUCKETS) if duration <= bound),
+                    len(DURATION_BUCKETS),
+                )
+                metrics['sampled'] += 1
+                metrics['queries'] += queries
+                metrics['duration_sum'] += duration
+                metrics['duration_buckets'][bucket] += 1
+
+    @api.model
+    def get_metrics(self):
+        """RPC : copie des compteurs du processus, par type de vérification"""
+        if not self.env.user.has_group('base.group_system'):
+            raise AccessError(_("Les métriques de prévention du stock sont réservées aux administrateurs."))
+        return self._get_metrics()
+
+    @api.model
+    def _get_metrics(self):
+        """Copie des compteurs du processus, sans contrôle d'accès (route à jeton)"""
+        with _metrics_lock:
+            return {
+                check: dict(metrics, duration_buckets=list(metrics['duration_buckets']))
+                for check, metrics in _metrics.items()
+            }
+
+    @api.model
+    def _get_prometheus_metrics(self):
+        """Compteurs au format texte Prometheus"""
+        output = []
+        metrics = self._get_metrics()
+        for name, key, help_text in (
+            ('stock_prevention_checks_total', 'checks', "Vérifications de stock exécutées"),
+            ('stock_prevention_lines_total', 'lines', "Lignes vérifiées"),
+            ('stock_prevention_sampled_checks_total', 'sampled', "Vérifications échantillonnées (durée et requêtes mesurées)"),
+            ('stock_prevention_queries_total', 'queries', "Requêtes SQL émises par les vérifications échantillonnées"),
+            ('stock_prevention_rejections_total', 'rejections', "Vérifications refusées pour stock insuffisant"),
+        ):
+            output.append(f'# HELP {name} {help_text}')
+            output.append(f'# TYPE {name} counter')
+            output.extend(f'{name}{{check="{check}"}} {values[key]}' for check, values in metrics.items())
+        name = 'stock_prevention_check_duration_seconds'
+        output.append(f'# HELP {name} Durée des vérifications de stock échantillonnées')
+        output.append(f'# TYPE {name} histogram')
+        for check, values in metrics.items():
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS + ('+Inf',), values['duration_buckets']):
+                cumulative += count
+                output.append(f'{name}_bucket{{check="{check}",le="{bound}"}} {cumulative}')
+            output.append(f'{name}_sum{{check="{check}"}} {values["duration_sum"]}')
+            output.append(f'{name}_count{{check="{check}"}} {values["sampled"]}')
+        return '\n'.join(output) + '\n'
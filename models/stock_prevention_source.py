@@ -0,0 +1,59 @@
+from odoo import api, fields, models, tools
+
+
+class StockPreventionSource(models.Model):
+    """Politique d'approvisionnement de la vérification de stock des ventes.
+
+    Liste ordonnée des entrepôts dont le stock peut servir une commande, par
+    société ou par équipe commerciale. Une commande est acceptée si la demande
+    est couverte par l'ensemble de ces entrepôts ; la répartition proposée suit
+    la séquence. Sans politique, seul l'entrepôt de la commande est vérifié.
+    """
+    _name = 'stock.prevention.source'
+    _description = "Entrepôt source pour la prévention du stock négatif"
+    _order = 'sequence, id'
+
+    sequence = fields.Integer(string="Séquence", default=10)
+    company_id = fields.Many2one(
+        'res.company', string="Société", required=True, index=True,
+        default=lambda self: self.env.company,
+    )
+    team_id = fields.Many2one(
+        'crm.team', string="Équipe commerciale", index=True,
+        help="Vide : politique par défaut de la société, utilisée par les équipes sans politique propre.",
+    )
+    warehouse_id = fields.Many2one(
+        'stock.warehouse', string="Entrepôt", required=True, ondelete='cascade',
+        domain="[('company_id', '=', company_id)]",
+    )
+
+    _sql_constraints = [
+        ('company_team_warehouse_uniq', 'unique(company_id, team_id, warehouse_id)',
+         "Un entrepôt ne peut apparaître qu'une fois dans une politique."),
+    ]
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        sources = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return sources
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
+
+    @api.model
+    @tools.ormcache('company_id', 'team_id')
+    def _get_sourcing_warehouse_ids(self, company_id, team_id):
+        """Entrepôts sources ordonnés : politique de l'équipe, sinon celle de la société"""
+        sources = self.sudo().search([('company_id', '=', company_id), ('team_id', '=', False)])
+        if team_id:
+            team_sources = self.sudo().search([('company_id', '=', company_id), ('team_id', '=', team_id)])
+            sources = team_sources or sources
+        return tuple(sources.warehouse_id.filtered('active').ids)
@@ -0,0 +1,383 @@
+from bisect import bisect_right
+
+from odoo import api, models, _
+from odoo.exceptions import UserError
+import logging
+import time
+
+from psycopg2.errors import LockNotAvailable
+
+_logger = logging.getLogger(__name__)
+
+
+# Champs de stock.quant dont la modification fait varier la table de disponibilité
+SNAPSHOT_QUANT_FIELDS = {'product_id', 'location_id', 'quantity', 'reserved_quantity'}
+
+# Les clés du cache de disponibilité contiennent l'empreinte de la sous-arborescence de
+# l'emplacement (voir StockLocation._get_stock_check_subtree_ids) : déplacer un casier
+# change l'empreinte, même si aucun quant n'est écrit.
+
+# Cache court par processus pour les lectures interactives (onchange, indicateur de ligne) :
+# {(base, emplacement, empreinte, produit): (horodatage, quantité disponible)}
+_availability_cache = {}
+AVAILABILITY_CACHE_SIZE = 10000
+
+# États des mouvements pris en compte par la projection du mode prévisionnel
+FORECAST_MOVE_STATES = ('confirmed', 'waiting', 'partially_available', 'assigned')
+
+
+class StockTimeline:
+    """Projection du stock d'un produit dans le temps.
+
+    base est la quantité de départ ; events la liste triée des variations
+    (date, quantité). La disponibilité à une date D est le minimum de la
+    projection à partir de D : la quantité promise à D doit rester disponible
+    pour tous les mouvements ultérieurs. Les minimums suffixes sont précalculés,
+    une interrogation coûte une recherche dichotomique.
+    Sans mouvement, la disponibilité est simplement la quantité de départ.
+    """
+
+    def __init__(self, base, events=()):
+        self.base = base
+        self.events = sorted(events)
+        self._build()
+
+    def _build(self):
+        self.dates = [date for date, quantity in self.events]
+        projection = []
+        cumulative = self.base
+        for date, quantity in self.events:
+            cumulative += quantity
+            projection.append(cumulative)
+        self.projection = projection
+        self.suffix_min = projection[:]
+        for index in range(len(projection) - 2, -1, -1):
+            self.suffix_min[index] = min(projection[index], self.suffix_min[index + 1])
+
+    def available_at(self, date=None):
+        if not self.events:
+            return self.base
+        index = bisect_right(self.dates, date) if date else 0
+        current = self.projection[index - 1] if index else self.base
+        if index < len(self.events):
+            return min(current, self.suffix_min[index])
+        return current
+
+    def consume(self, quantity, date=None):
+        """Décompte une quantité servie à la date donnée (maintenant si vide)"""
+        if not self.events or not date:
+            self.base -= quantity
+            self._build()
+        else:
+            self.events.insert(bisect_right(self.dates, date), (date, -quantity))
+            self._build()
+
+
+class StockQuant(models.Model):
+    _inherit = 'stock.quant'
+
+    @api.model
+    def _create(self, data_list):
+        """Override pour répercuter les nouveaux quants dans la table de disponibilité.
+
+        Surcharge de _create plutôt que de create : en mode inventaire, create
+        retourne un quant existant qu'il a retrouvé, ou rappelle create pour un
+        quant vide puis applique la quantité par write. Seules les lignes
+        réellement insérées passent par _create.
+        """
+        quants = super()._create(data_list)
+        quants._update_available_snapshot(sign=1)
+        return quants
+
+    def write(self, vals):
+        """Override pour répercuter les variations de quantité dans la table de disponibilité"""
+        if not SNAPSHOT_QUANT_FIELDS & set(vals):
+            return super().write(vals)
+        self._update_available_snapshot(sign=-1)
+        res = super().write(vals)
+        self._update_available_snapshot(sign=1)
+        return res
+
+    def unlink(self):
+        """Override pour retirer les quants supprimés de la table de disponibilité"""
+        self._update_available_snapshot(sign=-1)
+        return super().unlink()
+
+    def _update_available_snapshot(self, sign):
+        """Ajoute (sign=1) ou retire (sign=-1) ces quants de la table de disponibilité.
+
+        Chaque quant est reporté sur tous les emplacements suivis dont il est
+        descendant (comparaison des parent_path, sans requête supplémentaire).
+        """
+        if not self or not self.env['res.config.settings']._get_stock_prevention_flag('use_snapshot'):
+            return
+        tracked_locations = self.env['stock.available.snapshot']._get_tracked_locations()
+        deltas = {}
+        for quant in self:
+            parent_path = quant.location_id.parent_path or ''
+            for location_id, location_path in tracked_locations:
+                if parent_path.startswith(location_path):
+                    delta = deltas.setdefault((quant.product_id.id, location_id), [0.0, 0.0])
+                    delta[0] += sign * quant.quantity
+                    delta[1] += sign * quant.reserved_quantity
+        self.env['stock.available.snapshot']._apply_deltas(deltas)
+
+    @api.model
+    def _get_availability_timelines_multi(self, products, locations, forecast=False):
+        """Disponibilité par emplacement et par produit sous forme de StockTimeline :
+        {location_id: {product_id: StockTimeline}}.
+
+        Mode disponible (défaut) : quantité disponible actuelle, sans projection ;
+        tous les emplacements sont lus en une requête groupée.
+        Mode prévisionnel : stock physique plus les entrées et sorties prévues
+        (mouvements non terminés franchissant la limite de l'emplacement), chargées
+        en une seule requête par emplacement pour tous les produits et triées par date.
+        """
+        if not forecast:
+            return {
+                location_id: {
+                    product_id: StockTimeline(available_qty)
+                    for product_id, available_qty in available_by_product.items()
+                }
+                for location_id, available_by_product in self._get_available_quantity_maps(products, locations).items()
+            }
+        return {location.id: self._get_forecast_timelines(products, location) for location in locations}
+
+    @api.model
+    def _get_forecast_timelines(self, products, location):
+        """Projection du mode prévisionnel pour un emplacement (voir _get_availability_timelines_multi)"""
+        if not products or not location:
+            return {}
+        subtree_ids = location._get_stock_check_subtree_id_list()
+        on_hand = dict.fromkeys(products.ids, 0.0)
+        for product, quantity in self._read_group(
+            [
+                ('product_id', 'in', products.ids),
+                ('location_id', 'in', subtree_ids),
+            ],
+            groupby=['product_id'],
+            aggregates=['quantity:sum'],
+        ):
+            on_hand[product.id] = quantity
+        self.env['stock.move'].flush_model(['product_id', 'product_qty', 'date', 'state', 'location_id', 'location_dest_id'])
+        self.env.cr.execute("""
+            SELECT move.product_id,
+                   move.date,
+                   SUM(CASE WHEN move.location_dest_id = ANY(%(location_ids)s) THEN move.product_qty ELSE -move.product_qty END)
+              FROM stock_move move
+             WHERE move.product_id IN %(product_ids)s
+               AND move.state IN %(states)s
+               AND (move.location_id = ANY(%(location_ids)s)) != (move.location_dest_id = ANY(%(location_ids)s))
+          GROUP BY move.product_id, move.date
+        """, {
+            'location_ids': subtree_ids,
+            'product_ids': tuple(products.ids),
+            'states': FORECAST_MOVE_STATES,
+        })
+        events = {}
+        for product_id, date, quantity in self.env.cr.fetchall():
+            events.setdefault(product_id, []).append((date, quantity))
+        return {
+            product_id: StockTimeline(quantity, events.get(product_id, ()))
+            for product_id, quantity in on_hand.items()
+        }
+
+    @api.model
+    def _get_cached_available_quantity_map(self, products, location, ttl):
+        """Comme _get_available_quantity_map, avec un cache de ttl secondes par (produit, emplacement).
+
+        Réservé aux affichages indicatifs : la confirmation relit toujours le stock.
+        """
+        if not products or not location:
+            return {}
+        now = time.monotonic()
+        dbname = self.env.cr.dbname
+        subtree_key = hash(self.env['stock.location']._get_stock_check_subtree_ids(location.id))
+        available = {}
+        missing_ids = []
+        for product_id in products.ids:
+            entry = _availability_cache.get((dbname, location.id, subtree_key, product_id))
+            if entry and now - entry[0] < ttl:
+                available[product_id] = entry[1]
+            else:
+                missing_ids.append(product_id)
+        if missing_ids:
+            fresh = self._get_available_quantity_map(self.env['product.product'].browse(missing_ids), location)
+            if len(_availability_cache) + len(fresh) > AVAILABILITY_CACHE_SIZE:
+                _availability_cache.clear()
+            for product_id, available_qty in fresh.items():
+                _availability_cache[dbname, location.id, subtree_key, product_id] = (now, available_qty)
+            available.update(fresh)
+        return available
+
+    @api.model
+    def _get_available_quantity_map(self, products, location):
+        """Moteur de disponibilité partagé Vente / POS : {product_id: quantité disponible}
+        sous l'emplacement (enfants inclus), en une requête agrégée. Le stock est toujours relu."""
+        if not products or not location:
+            return {}
+        Snapshot = self.env['stock.available.snapshot']
+        if (
+            self.env['res.config.settings']._get_stock_prevention_flag('use_snapshot')
+            and Snapshot._is_tracked_location(location)
+        ):
+            return Snapshot._get_available_quantity_map(products, location)
+        self.flush_model(['product_id', 'location_id', 'quantity', 'reserved_quantity'])
+        available = dict.fromkeys(products.ids, 0.0)
+        self.env.cr.execute("""
+            SELECT product_id, SUM(quantity - reserved_quantity)
+              FROM stock_quant
+             WHERE location_id = ANY(%s)
+               AND product_id IN %s
+          GROUP BY product_id
+        """, (location._get_stock_check_subtree_id_list(), tuple(products.ids)))
+        # available_quantity = quantity - reserved_quantity (champ non stocké)
+        available.update(self.env.cr.fetchall())
+        return available
+
+    @api.model
+    def _get_available_quantity_maps(self, products, locations):
+        """Disponibilité de plusieurs emplacements en une seule requête groupée.
+
+        Retourne {location_id: {product_id: quantité disponible}}, chaque
+        emplacement cumulant ses enfants comme _get_available_quantity_map.
+        """
+        if not products or not locations:
+            return {}
+        if len(locations) == 1:
+            return {locations.id: self._get_available_quantity_map(products, locations)}
+        available = {location.id: dict.fromkeys(products.ids, 0.0) for location in locations}
+        Snapshot = self.env['stock.available.snapshot']
+        if (
+            self.env['res.config.settings']._get_stock_prevention_flag('use_snapshot')
+            and all(Snapshot._is_tracked_location(location) for location in locations)
+        ):
+            self.env.cr.execute("""
+                SELECT location_id, product_id, quantity - reserved_quantity
+                  FROM stock_available_snapshot
+                 WHERE location_id IN %s
+                   AND product_id IN %s
+            """, (tuple(locations.ids), tuple(products.ids)))
+            for location_id, product_id, available_qty in self.env.cr.fetchall():
+                available[location_id][product_id] = available_qty
+            return available
+
+        self.flush_model(['product_id', 'location_id', 'quantity', 'reserved_quantity'])
+        # Racines dont chaque emplacement fait partie (une racine peut en contenir une autre)
+        roots_by_location = {}
+        for root in locations:
+            for location_id in self.env['stock.location']._get_stock_check_subtree_ids(root.id):
+                roots_by_location.setdefault(location_id, []).append(root.id)
+        self.env.cr.execute("""
+            SELECT location_id, product_id, SUM(quantity - reserved_quantity)
+              FROM stock_quant
+             WHERE location_id = ANY(%s)
+               AND product_id IN %s
+          GROUP BY location_id, product_id
+        """, (sorted(roots_by_location), tuple(products.ids)))
+        for location_id, product_id, available_qty in self.env.cr.fetchall():
+            for root_id in roots_by_location[location_id]:
+                available[root_id][product_id] += available_qty
+        return available
+
+    @api.model
+    def _lock_available_quantities(self, products, locations):
+        """Mode strict : verrouille jusqu'à la fin de la transaction les lignes de stock lues
+        pour ces produits sous ces emplacements, en un seul SELECT ... FOR UPDATE trié par id
+        (ordre global de prise des verrous, sans interblocage)."""
+        if not products or not locations:
+            return
+        if not self.env['res.config.settings']._get_stock_prevention_flag('strict_locking'):
+            return
+        lock_timeout = int(self.env['ir.config_parameter'].sudo().get_param(
+            'stock_negative_prevention.lock_timeout', 5000
+        ))
+        Snapshot = self.env['stock.available.snapshot']
+        if (
+            self.env['res.config.settings']._get_stock_prevention_flag('use_snapshot')
+            and all(Snapshot._is_tracked_location(location) for location in locations)
+        ):
+            query = """
+                SELECT id
+                  FROM stock_available_snapshot
+                 WHERE location_id = ANY(%s)
+                   AND product_id IN %s
+              ORDER BY id
+                   FOR UPDATE
+            """
+            params = (locations.ids, tuple(products.ids))
+        else:
+            query = """
+                SELECT id
+                  FROM stock_quant
+                 WHERE location_id = ANY(%s)
+                   AND product_id IN %s
+              ORDER BY id
+                   FOR UPDATE
+            """
+            params = (locations._get_stock_check_subtree_id_list(), tuple(products.ids))
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute("SET LOCAL lock_timeout = %s", (lock_timeout,))
+                self.env.cr.execute(query, params)
+        except LockNotAvailable:
+            _logger.warning("STOCK PREVENTION: Verrou non obtenu sur le stock des emplacements %s après %s ms", locations.ids, lock_timeout)
+            raise UserError(_(
+                "Le stock de ces produits est en cours de mise à jour par une autre opération.\n"
+                "Veuillez réessayer dans quelques instants."
+            ))
+        finally:
+            self.env.cr.execute("SET LOCAL lock_timeout TO DEFAULT")
+
+    @api.model
+    def _get_stock_watermark(self, products, locations, forecast=False):
+        """Filigrane du stock de ces produits sous ces emplacements (enfants inclus).
+
+        Une requête agrégée : dernière écriture, nombre de quants et sommes des
+        quantités. La dernière écriture seule ne suffit pas : une transaction
+        commencée plus tôt peut être validée après coup avec un write_date plus
+        ancien, et une suppression ne laisse aucune date. En mode prévisionnel, la
+        dernière écriture sur les mouvements de ces produits est ajoutée.
+        """
+        if not products or not locations:
+            return False
+        self.flush_model(['product_id', 'location_id', 'quantity', 'reserved_quantity', 'write_date'])
+        self.env.cr.execute("""
+            SELECT MAX(write_date), COUNT(*), SUM(quantity), SUM(reserved_quantity)
+              FROM stock_quant
+             WHERE location_id = ANY(%s)
+               AND product_id IN %s
+        """, (locations._get_stock_check_subtree_id_list(), tuple(products.ids)))
+        watermark = self.env.cr.fetchone()
+        if forecast:
+            self.env['stock.move'].flush_model(['product_id', 'write_date'])
+            self.env.cr.execute("""
+                SELECT MAX(write_date)
+                  FROM stock_move
+                 WHERE product_id IN %s
+            """, (tuple(products.ids),))
+            watermark += self.env.cr.fetchone()
+        return '|'.join(str(value) for value in watermark)
+
+    @api.model
+    def _get_location_stock_version(self, location):
+        """Version du stock d'un emplacement : dernière écriture sur ses quants (enfants inclus)"""
+        self.flush_model(['location_id', 'write_date'])
+        self.env.cr.execute("""
+            SELECT MAX(write_date)
+              FROM stock_quant
+             WHERE location_id = ANY(%s)
+        """, (location._get_stock_check_subtree_id_list(),))
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _get_changed_product_ids(self, location, since):
+        """Produits dont un quant de l'emplacement (enfants inclus) a été écrit depuis 'since'"""
+        self.flush_model(['location_id', 'product_id', 'write_date'])
+        self.env.cr.execute("""
+            SELECT DISTINCT product_id
+              FROM stock_quant
+             WHERE location_id = ANY(%s)
+               AND write_date >= %s
+        """, (location._get_stock_check_subtree_id_list(), since))
+        return [product_id for product_id, in self.env.cr.fetchall()]
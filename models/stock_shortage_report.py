@@ -0,0 +1,121 @@
+from odoo import api, fields, models, _
+
+
+class StockShortageReport(models.Model):
+    """Résultat d'une vérification de stock d'une commande de vente.
+
+    Le rapport conserve les produits manquants sous forme de lignes, au lieu
+    d'un message d'erreur. Il porte le filigrane du stock vérifié (voir
+    StockQuant._get_stock_watermark) et la clé de la demande : tant que ni le
+    stock ni la commande n'ont changé, une nouvelle vérification le réutilise
+    sans recalcul.
+    """
+    _name = 'stock.shortage.report'
+    _description = 'Rapport de manque de stock'
+    _order = 'id desc'
+
+    name = fields.Char(string="Référence", required=True, readonly=True)
+    order_id = fields.Many2one('sale.order', string="Commande", index=True, ondelete='cascade', readonly=True)
+    company_id = fields.Many2one(
+        'res.company', string="Société", required=True, readonly=True,
+        default=lambda self: self.env.company,
+    )
+    user_id = fields.Many2one(
+        'res.users', string="Vérifié par", readonly=True,
+        default=lambda self: self.env.user,
+    )
+    state = fields.Selection(
+        [
+            ('ok', "Stock suffisant"),
+            ('short', "Stock insuffisant"),
+        ],
+        string="Résultat",
+        required=True,
+        readonly=True,
+    )
+    line_ids = fields.One2many('stock.shortage.report.line', 'report_id', string="Produits manquants", readonly=True)
+    missing_product_count = fields.Integer(
+        string="Produits manquants",
+        compute='_compute_missing_product_count',
+        store=True,
+    )
+    split_note = fields.Text(string="Répartition proposée", readonly=True)
+    watermark = fields.Char(string="Filigrane du stock", readonly=True)
+    demand_key = fields.Char(string="Clé de la demande", readonly=True)
+
+    @api.depends('line_ids')
+    def _compute_missing_product_count(self):
+        for report in self:
+            report.missing_product_count = len(report.line_ids)
+
+    @api.model
+    def _create_from_shortages(self, orders, shortages, splits=None, keys=None):
+        """Crée un rapport par commande à partir du résultat de SaleOrder._get_stock_allocation.
+
+        keys : {order_id: (filigrane, clé de la demande)} rendant le rapport réutilisable.
+        Retourne {order_id: rapport}.
+        """
+        splits = splits or {}
+        keys = keys or {}
+        vals_list = []
+        for order in orders:
+            watermark, demand_key = keys.get(order.id, (False, False))
+            vals_list.append({
+                'name': order.name,
+                'order_id': order.id,
+                'company_id': order.company_id.id,
+                'state': 'short' if order.id in shortages else 'ok',
+                'split_note': order._get_stock_split_message(splits) if order.id in splits else False,
+                'watermark': watermark,
+                'demand_key': demand_key,
+                'line_ids': [(0, 0, {
+                    'product_id': product_info['product_id'],
+                    'requested_qty': product_info['requested'],
+                    'available_qty': product_info['available'],
+                    'location_id': product_info['location_id'],
+                    'warehouse': product_info['warehouse'],
+                    'order_lines': ', '.join(str(position) for position in product_info['lines']),
+                }) for product_info in shortages.get(order.id, [])],
+            })
+        reports = self.create(vals_list)
+        return {report.order_id.id: report for report in reports}
+
+    def action_open(self):
+        """Ouvre le rapport dans une fenêtre de dialogue"""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Stock insuffisant : %s') % self.name,
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+
+class StockShortageReportLine(models.Model):
+    _name = 'stock.shortage.report.line'
+    _description = 'Ligne de rapport de manque de stock'
+    _order = 'report_id desc, missing_qty desc, id'
+
+    report_id = fields.Many2one('stock.shortage.report', string="Rapport", required=True, index=True, ondelete='cascade')
+    order_id = fields.Many2one(related='report_id.order_id', store=True, index=True)
+    company_id = fields.Many2one(related='report_id.company_id', store=True)
+    product_id = fields.Many2one('product.product', string="Produit", required=True, index=True)
+    uom_id = fields.Many2one(related='product_id.uom_id', string="Unité")
+    requested_qty = fields.Float(string="Demandé", digits='Product Unit of Measure')
+    available_qty = fields.Float(string="Disponible", digits='Product Unit of Measure')
+    missing_qty = fields.Float(
+        string="Manquant",
+        digits='Product Unit of Measure',
+        compute='_compute_missing_qty',
+        store=True,
+    )
+    location_id = fields.Many2one('stock.location', string="Emplacement")
+    warehouse = fields.Char(string="Entrepôt(s)")
+    order_lines = fields.Char(string="Lignes de commande")
+
+    @api.depends('requested_qty', 'available_qty')
+    def _compute_missing_qty(self):
+        for line in self:
+            line.missing_qty = line.requested_qty - line.available_qty
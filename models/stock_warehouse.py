@@ -0,0 +1,36 @@
+from odoo import api, models
+
+# Champs intervenant dans la résolution de l'entrepôt / emplacement de vérification
+STOCK_CHECK_WAREHOUSE_FIELDS = {'active', 'company_id', 'sequence', 'lot_stock_id'}
+
+
+class StockWarehouse(models.Model):
+    _inherit = 'stock.warehouse'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Override pour invalider l'entrepôt par défaut mis en cache par société"""
+        warehouses = super().create(vals_list)
+        self.env.registry.clear_cache()
+        warehouses._rebuild_available_snapshot()
+        return warehouses
+
+    def write(self, vals):
+        """Override pour invalider les emplacements de vérification mis en cache"""
+        res = super().write(vals)
+        if STOCK_CHECK_WAREHOUSE_FIELDS & set(vals):
+            self.env.registry.clear_cache()
+        if 'lot_stock_id' in vals:
+            self._rebuild_available_snapshot()
+        return res
+
+    def unlink(self):
+        """Override pour invalider l'entrepôt par défaut mis en cache par société"""
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
+
+    def _rebuild_available_snapshot(self):
+        """Initialise la table de disponibilité pour les nouveaux emplacements suivis"""
+        if self.env['res.config.settings']._get_stock_prevention_flag('use_snapshot'):
+            self.env['stock.available.snapshot']._rebuild(self.lot_stock_id)
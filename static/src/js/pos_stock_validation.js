@@ -0,0 +1,130 @@
+/** @odoo-module */
+
+import { patch } from "@web/core/utils/patch";
+import { _t } from "@web/core/l10n/translation";
+import { AlertDialog } from "@web/core/confirmation_dialog/confirmation_dialog";
+import { PosStore } from "@point_of_sale/app/store/pos_store";
+import { PosOrderline } from "@point_of_sale/app/models/pos_order_line";
+
+// Intervalle de mise à jour de l'instantané de stock (deltas depuis la dernière version)
+const STOCK_SNAPSHOT_REFRESH_MS = 60000;
+
+// Les lignes de commande n'ont pas accès au store : référence posée au démarrage
+let posStore = null;
+
+patch(PosStore.prototype, {
+    async setup() {
+        await super.setup(...arguments);
+        posStore = this;
+        this.stockPrevention = { enabled: false, version: false, quantities: {}, reflected: new Set() };
+        await this.refreshStockPreventionSnapshot();
+        setInterval(() => this.refreshStockPreventionSnapshot(), STOCK_SNAPSHOT_REFRESH_MS);
+    },
+
+    /**
+     * Charge l'instantané de disponibilité de la session, puis uniquement les
+     * produits modifiés depuis la version précédente. Hors ligne, le dernier
+     * instantané reçu reste utilisé.
+     */
+    async refreshStockPreventionSnapshot() {
+        // Commandes déjà synchronisées au moment de l'appel : leur stock est compris dans la réponse
+        const reflected = this.models["pos.order"]
+            .getAll()
+            .filter((order) => order.finalized && typeof order.id === "number")
+            .map((order) => order.uuid);
+        let result;
+        try {
+            result = await this.data.call("pos.session", "get_stock_prevention_snapshot", [
+                [this.session.id],
+                this.stockPrevention.version,
+            ]);
+        } catch {
+            return;
+        }
+        if (!result.enabled) {
+            this.stockPrevention = { enabled: false, version: false, quantities: {}, reflected: new Set() };
+            return;
+        }
+        const quantities = result.full ? {} : this.stockPrevention.quantities;
+        Object.assign(quantities, result.quantities);
+        this.stockPrevention = {
+            enabled: true,
+            version: result.version,
+            quantities,
+            reflected: new Set(reflected),
+        };
+    },
+
+    /**
+     * Quantités par produit des commandes payées sur la caisse dont le stock
+     * n'est pas encore compris dans l'instantané : non synchronisées (hors
+     * ligne), ou synchronisées depuis le dernier chargement.
+     */
+    getStockPreventionPendingQuantities() {
+        const pending = {};
+        for (const order of this.models["pos.order"].getAll()) {
+            if (!order.finalized || this.stockPrevention.reflected.has(order.uuid)) {
+                continue;
+            }
+            for (const line of order.get_orderlines()) {
+                const productId = line.product_id.id;
+                pending[productId] = (pending[productId] || 0) + Math.max(line.get_quantity(), 0);
+            }
+        }
+        return pending;
+    },
+
+    /**
+     * Retourne un message d'erreur si la quantité totale du produit dans la
+     * commande courante (ligne modifiée exclue) plus `qty` dépasse le stock connu.
+     */
+    getStockPreventionError(product, qty, excludedLine = null) {
+        if (!this.stockPrevention?.enabled || qty <= 0) {
+            return false;
+        }
+        const known = this.stockPrevention.quantities[product.id];
+        if (known === undefined) {
+            // Produit non suivi (service, non stockable) : pas de vérification locale
+            return false;
+        }
+        // Les tickets déjà payés sur cette caisse consomment le stock connu
+        const available = known - (this.getStockPreventionPendingQuantities()[product.id] || 0);
+        const order = this.get_order();
+        const requested =
+            qty +
+            (order ? order.get_orderlines() : [])
+                .filter((line) => line !== excludedLine && line.product_id.id === product.id)
+                .reduce((total, line) => total + Math.max(line.get_quantity(), 0), 0);
+        if (requested <= available) {
+            return false;
+        }
+        return {
+            title: _t("Stock insuffisant"),
+            body: _t(
+                "Stock insuffisant pour %(product)s.\nQuantité demandée : %(requested)s\nQuantité disponible : %(available)s",
+                { product: product.display_name, requested, available }
+            ),
+        };
+    },
+
+    async addLineToCurrentOrder(vals, opts = {}, configure = true) {
+        const error = vals.product_id && this.getStockPreventionError(vals.product_id, vals.qty || 1);
+        if (error) {
+            this.dialog.add(AlertDialog, error);
+            return;
+        }
+        return await super.addLineToCurrentOrder(...arguments);
+    },
+});
+
+patch(PosOrderline.prototype, {
+    set_quantity(quantity, keep_price) {
+        const qty = typeof quantity === "number" ? quantity : parseFloat(quantity);
+        const error = !isNaN(qty) && posStore?.getStockPreventionError(this.product_id, qty, this);
+        if (error) {
+            // Même convention que les contrôles natifs : l'appelant affiche l'erreur
+            return error;
+        }
+        return super.set_quantity(...arguments);
+    },
+});
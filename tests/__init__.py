@@ -0,0 +1,4 @@
+from . import test_concurrency
+from . import test_performance
+from . import test_stock_check
+from . import test_stock_timeline
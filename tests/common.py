@@ -0,0 +1,97 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from odoo.tests import TransactionCase
+
+_logger = logging.getLogger(__name__)
+
+
+class StockPreventionCommon(TransactionCase):
+    """Jeu de données commun : arborescence d'emplacements profonde sous le stock
+    de l'entrepôt, produits stockables répartis sur plusieurs casiers, session POS.
+
+    Les volumes sont des attributs de classe : les tests fonctionnels les réduisent."""
+
+    PRODUCT_COUNT = 500
+    TREE_DEPTH = 8
+    BINS_PER_LEVEL = 4
+    QUANTS_PER_PRODUCT = 3
+    QTY_PER_QUANT = 10.0
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env.company.write({
+            'prevent_negative_stock_sales': True,
+            'prevent_negative_stock_pos': True,
+        })
+
+        cls.warehouse = cls.env['stock.warehouse'].search([('company_id', '=', cls.env.company.id)], limit=1)
+        cls.stock_location = cls.warehouse.lot_stock_id
+        cls.partner = cls.env['res.partner'].create({'name': 'Client prévention stock'})
+
+        cls.bins = cls.env['stock.location']
+        parent = cls.stock_location
+        for depth in range(cls.TREE_DEPTH):
+            level = cls.env['stock.location'].create([{
+                'name': f'N{depth}-{index}',
+                'location_id': parent.id,
+                'usage': 'internal',
+            } for index in range(cls.BINS_PER_LEVEL)])
+            cls.bins |= level
+            parent = level[0]
+
+        cls.products = cls.env['product.product'].create([{
+            'name': f'Produit prévention {index}',
+            'type': 'consu',
+            'is_storable': True,
+            'available_in_pos': True,
+        } for index in range(cls.PRODUCT_COUNT)])
+        bins = cls.bins.sorted('id')
+        for index, product in enumerate(cls.products):
+            for offset in range(cls.QUANTS_PER_PRODUCT):
+                cls.env['stock.quant']._update_available_quantity(
+                    product, bins[(index + offset * 7) % len(bins)], cls.QTY_PER_QUANT,
+                )
+        cls.stock_per_product = cls.QUANTS_PER_PRODUCT * cls.QTY_PER_QUANT
+
+        cls.pos_config = cls.env['pos.config'].create({
+            'name': 'POS prévention stock',
+            'picking_type_id': cls.warehouse.pos_type_id.id,
+        })
+        cls.pos_session = cls.env['pos.session'].create({
+            'config_id': cls.pos_config.id,
+            'user_id': cls.env.uid,
+        })
+
+    @classmethod
+    def _create_sale_order(cls, line_count, qty=1.0):
+        return cls.env['sale.order'].create({
+            'partner_id': cls.partner.id,
+            'warehouse_id': cls.warehouse.id,
+            'order_line': [(0, 0, {
+                'product_id': product.id,
+                'product_uom_qty': qty,
+            }) for product in cls.products[:line_count]],
+        })
+
+    @classmethod
+    def _pos_order_payload(cls, line_count, qty=1.0):
+        """Commande POS telle que reçue de la caisse par sync_from_ui / _process_order"""
+        return {
+            'name': f'Commande POS {line_count} lignes',
+            'session_id': cls.pos_session.id,
+            'state': 'paid',
+            'lines': [[0, 0, {
+                'product_id': product.id,
+                'qty': qty,
+            }] for product in cls.products[:line_count]],
+        }
+
+    @contextmanager
+    def _timed(self, label):
+        """Enregistre la durée du bloc dans les logs (suivi des régressions)"""
+        start = time.perf_counter()
+        yield
+        _logger.info("STOCK PREVENTION BENCH: %s en %.1f ms", label, (time.perf_counter() - start) * 1000)
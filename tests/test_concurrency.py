@@ -0,0 +1,132 @@
+import logging
+import threading
+import time
+
+from psycopg2.errors import LockNotAvailable, SerializationFailure
+
+from odoo import SUPERUSER_ID, api
+from odoo.exceptions import UserError
+from odoo.modules.registry import Registry
+from odoo.tests import BaseCase, get_db_name, tagged
+
+_logger = logging.getLogger(__name__)
+
+
+@tagged('post_install', '-at_install', '-standard', 'stock_prevention_concurrency')
+class TestConcurrentConfirmation(BaseCase):
+    """Confirmations simultanées depuis plusieurs threads / curseurs.
+
+    Les données sont validées (commit) pour être visibles des autres curseurs,
+    puis supprimées (commandes, transferts), remises à zéro (stock) ou archivées
+    en fin de test ; les paramètres modifiés retrouvent leur valeur d'origine.
+    Hors de la suite standard : --test-tags stock_prevention_concurrency.
+    """
+
+    THREADS = 8
+    STOCK = 10.0
+    ORDER_QTY = 3.0
+    # Rejeux maximum par confirmation (erreur de sérialisation ou verrou non obtenu)
+    MAX_RETRIES = 10
+    # Délai d'attente des verrous (ms) : assez long pour que les confirmations s'enchaînent
+    LOCK_TIMEOUT = 30000
+    PARAMS = ('strict_locking', 'lock_timeout')
+
+    def setUp(self):
+        super().setUp()
+        self.registry = Registry(get_db_name())
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            ICP = env['ir.config_parameter']
+            # Valeurs d'origine restaurées en fin de test
+            self.original_prevent_sales = env.company.prevent_negative_stock_sales
+            self.original_params = {
+                name: ICP.get_param(f'stock_negative_prevention.{name}') for name in self.PARAMS
+            }
+            env.company.prevent_negative_stock_sales = True
+            ICP.set_param('stock_negative_prevention.strict_locking', 'True')
+            ICP.set_param('stock_negative_prevention.lock_timeout', str(self.LOCK_TIMEOUT))
+            warehouse = env['stock.warehouse'].search([('company_id', '=', env.company.id)], limit=1)
+            self.location_id = warehouse.lot_stock_id.id
+            self.partner_id = env['res.partner'].create({'name': 'Client concurrence'}).id
+            product = env['product.product'].create({
+                'name': 'Produit concurrence',
+                'type': 'consu',
+                'is_storable': True,
+            })
+            self.product_id = product.id
+            env['stock.quant']._update_available_quantity(product, warehouse.lot_stock_id, self.STOCK)
+            self.order_ids = env['sale.order'].create([{
+                'partner_id': self.partner_id,
+                'warehouse_id': warehouse.id,
+                'order_line': [(0, 0, {'product_id': product.id, 'product_uom_qty': self.ORDER_QTY})],
+            } for _i in range(self.THREADS)]).ids
+        self.addCleanup(self._cleanup)
+
+    def _cleanup(self):
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            orders = env['sale.order'].browse(self.order_ids)
+            pickings = orders.picking_ids
+            pickings.filtered(lambda p: p.state != 'done').action_cancel()
+            pickings.unlink()
+            orders._action_cancel()
+            orders.unlink()
+            # Stock validé par setUp remis à zéro (le quant vide est ensuite nettoyé par stock.quant)
+            product = env['product.product'].browse(self.product_id)
+            location = env['stock.location'].browse(self.location_id)
+            quantity = env['stock.quant']._get_available_quantity(product, location)
+            if quantity:
+                env['stock.quant']._update_available_quantity(product, location, -quantity)
+            # L'historique des mouvements peut encore référencer le produit : archivage plutôt que suppression
+            product.product_tmpl_id.active = False
+            env['res.partner'].browse(self.partner_id).active = False
+            env.company.prevent_negative_stock_sales = self.original_prevent_sales
+            for name, value in self.original_params.items():
+                env['ir.config_parameter'].set_param(f'stock_negative_prevention.{name}', value)
+
+    def _confirm(self, order_id, results, barrier):
+        """Confirme une commande dans son propre curseur, avec rejeu borné sur erreur de
+        sérialisation ou verrou non obtenu, comme le fait le serveur pour une requête RPC."""
+        barrier.wait()
+        start = time.perf_counter()
+        for retries in range(self.MAX_RETRIES + 1):
+            try:
+                with self.registry.cursor() as cr:
+                    env = api.Environment(cr, SUPERUSER_ID, {})
+                    env['sale.order'].browse(order_id).action_confirm()
+                results[order_id] = ('confirmed', retries, time.perf_counter() - start)
+                return
+            except SerializationFailure:
+                continue
+            except UserError as e:
+                # Verrou non obtenu (voir StockQuant._lock_available_quantities) : rejeu
+                if isinstance(e.__context__, LockNotAvailable):
+                    continue
+                results[order_id] = ('rejected', retries, time.perf_counter() - start)
+                return
+        results[order_id] = ('failed', self.MAX_RETRIES, time.perf_counter() - start)
+
+    def test_no_oversell_under_concurrent_confirmations(self):
+        results = {}
+        barrier = threading.Barrier(self.THREADS)
+        threads = [
+            threading.Thread(target=self._confirm, args=(order_id, results, barrier))
+            for order_id in self.order_ids
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        confirmed = [order_id for order_id, (state, retries, duration) in results.items() if state == 'confirmed']
+        self.assertEqual(len(results), self.THREADS)
+        self.assertNotIn('failed', [state for state, retries, duration in results.values()], "Rejeux épuisés")
+        self.assertLessEqual(len(confirmed) * self.ORDER_QTY, self.STOCK, "Stock survendu par des confirmations simultanées")
+        self.assertEqual(len(confirmed), int(self.STOCK // self.ORDER_QTY))
+        _logger.info(
+            "STOCK PREVENTION BENCH: %s confirmations simultanées en %.3fs (%.1f/s), %s confirmée(s), %s rejeu(x)",
+            self.THREADS, elapsed, self.THREADS / elapsed, len(confirmed),
+            sum(retries for state, retries, duration in results.values()),
+        )
@@ -0,0 +1,118 @@
+from odoo.tests import tagged
+
+from .common import StockPreventionCommon
+
+# Le coût d'une vérification ne doit pas dépendre du nombre de lignes :
+# bornes identiques pour 1, 50 et 500 lignes.
+LINE_COUNTS = (1, 50, 500)
+SALE_CHECK_MAX_QUERIES = 20
+# Arborescence d'entrepôt : allées x casiers sous l'emplacement de stock
+TREE_AISLES = 40
+TREE_BINS_PER_AISLE = 50
+POS_CHECK_MAX_QUERIES = 12
+POS_LINE_CHECK_MAX_QUERIES = 12
+
+
+@tagged('post_install', '-at_install', 'stock_prevention_perf')
+class TestStockCheckPerformance(StockPreventionCommon):
+
+    def _warm_up(self, check):
+        """Premier appel pour remplir les caches ormcache, puis cache ORM vidé
+        afin de mesurer une requête « à froid » comme en production."""
+        check()
+        self.env.invalidate_all()
+
+    def test_sale_check_query_count(self):
+        for line_count in LINE_COUNTS:
+            with self.subTest(lines=line_count):
+                order = self._create_sale_order(line_count)
+                self._warm_up(order._check_stock_availability)
+                with self._timed(f"_check_stock_availability {line_count} lignes"), \
+                        self.assertQueryCount(SALE_CHECK_MAX_QUERIES):
+                    order._check_stock_availability()
+
+    def test_sale_batch_check_query_count(self):
+        orders = self.env['sale.order'].concat(*(self._create_sale_order(50) for _index in range(10)))
+        self._warm_up(orders._get_stock_shortages)
+        with self._timed("_get_stock_shortages 10 commandes x 50 lignes"), \
+                self.assertQueryCount(SALE_CHECK_MAX_QUERIES):
+            orders._get_stock_shortages()
+
+    def test_pos_check_query_count(self):
+        PosOrder = self.env['pos.order']
+        for line_count in LINE_COUNTS:
+            with self.subTest(lines=line_count):
+                payload = self._pos_order_payload(line_count)
+                self._warm_up(lambda: PosOrder._check_pos_stock_availability(payload))
+                with self._timed(f"_check_pos_stock_availability {line_count} lignes"), \
+                        self.assertQueryCount(POS_CHECK_MAX_QUERIES):
+                    PosOrder._check_pos_stock_availability(payload)
+
+    def test_pos_batch_check_query_count(self):
+        PosOrder = self.env['pos.order']
+        payloads = [self._pos_order_payload(10) for _index in range(50)]
+        self._warm_up(lambda: PosOrder._check_pos_orders_stock_availability(payloads))
+        with self._timed("_check_pos_orders_stock_availability 50 commandes x 10 lignes"), \
+                self.assertQueryCount(POS_CHECK_MAX_QUERIES):
+            verdicts = PosOrder._check_pos_orders_stock_availability(payloads)
+        self.assertTrue(all(verdict['ok'] for verdict in verdicts))
+
+    def test_pos_line_check_query_count(self):
+        pos_order = self.env['pos.order'].create({
+            'session_id': self.pos_session.id,
+            'amount_tax': 0.0,
+            'amount_total': 0.0,
+            'amount_paid': 0.0,
+            'amount_return': 0.0,
+        })
+        PosOrderLine = self.env['pos.order.line']
+        for line_count in LINE_COUNTS:
+            with self.subTest(lines=line_count):
+                line_demands = [
+                    (pos_order.id, product.id, 1.0, position)
+                    for position, product in enumerate(self.products[:line_count], start=1)
+                ]
+                self._warm_up(lambda: PosOrderLine._validate_pos_lines_stock(line_demands))
+                with self._timed(f"_validate_pos_lines_stock {line_count} lignes"), \
+                        self.assertQueryCount(POS_LINE_CHECK_MAX_QUERIES):
+                    PosOrderLine._validate_pos_lines_stock(line_demands)
+
+    def test_location_tree_query_count(self):
+        """Sur une arborescence de milliers de casiers, la lecture ne dépend pas de la taille de l'arbre"""
+        Location = self.env['stock.location']
+        aisles = Location.create([{
+            'name': f'Allée {index}',
+            'location_id': self.stock_location.id,
+            'usage': 'internal',
+        } for index in range(TREE_AISLES)])
+        bins = Location.create([{
+            'name': f'Casier {index}',
+            'location_id': aisle.id,
+            'usage': 'internal',
+        } for aisle in aisles for index in range(TREE_BINS_PER_AISLE)])
+        StockQuant = self.env['stock.quant']
+        products = self.products[:50]
+        for product, location in zip(products, bins[::len(bins) // len(products)]):
+            StockQuant._update_available_quantity(product, location, 1.0)
+
+        expected = {product.id: quantity for product, quantity in StockQuant._read_group(
+            [('product_id', 'in', products.ids), ('location_id', 'child_of', self.stock_location.id)],
+            ['product_id'], ['quantity:sum'],
+        )}
+        with self._timed(f"child_of {len(bins)} casiers"):
+            StockQuant._read_group(
+                [('product_id', 'in', products.ids), ('location_id', 'child_of', self.stock_location.id)],
+                ['product_id'], ['quantity:sum'],
+            )
+        self._warm_up(lambda: Location._get_stock_check_subtree_ids(self.stock_location.id))
+        with self._timed(f"_get_available_quantity_map {len(bins)} casiers"), \
+                self.assertQueryCount(SALE_CHECK_MAX_QUERIES):
+            available = StockQuant._get_available_quantity_map(products, self.stock_location)
+        self.assertEqual(available, expected)
+
+        # Un nouveau casier vide le cache : son stock est compté à la lecture suivante
+        new_bin = Location.create({'name': 'Casier ajouté', 'location_id': aisles[0].id, 'usage': 'internal'})
+        StockQuant._update_available_quantity(products[0], new_bin, 1.0)
+        self.assertIn(new_bin.id, Location._get_stock_check_subtree_ids(self.stock_location.id))
+        available = StockQuant._get_available_quantity_map(products, self.stock_location)
+        self.assertEqual(available[products[0].id], expected[products[0].id] + 1.0)
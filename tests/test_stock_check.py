@@ -0,0 +1,307 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import StockPreventionCommon
+
+
+@tagged('post_install', '-at_install')
+class TestStockCheck(StockPreventionCommon):
+    """Tests fonctionnels de la vérification, sur un jeu de données réduit
+    (les volumes de StockPreventionCommon ne servent qu'aux mesures de performance)."""
+
+    PRODUCT_COUNT = 10
+    TREE_DEPTH = 2
+    BINS_PER_LEVEL = 2
+
+    def test_sale_demand_aggregated_per_product(self):
+        """Plusieurs lignes d'un même produit sont comparées ensemble au stock"""
+        product = self.products[0]
+        order = self.env['sale.order'].create({
+            'partner_id': self.partner.id,
+            'warehouse_id': self.warehouse.id,
+            'order_line': [(0, 0, {
+                'product_id': product.id,
+                'product_uom_qty': self.stock_per_product / 2 + 1,
+            }) for _index in range(2)],
+        })
+        with self.assertRaises(UserError):
+            order._check_stock_availability()
+
+    def test_sale_batch_allocation(self):
+        """Le stock est alloué par priorité : la seconde commande ne peut plus être servie"""
+        first = self._create_sale_order(1, qty=self.stock_per_product)
+        second = self._create_sale_order(1, qty=1.0)
+        shortages = (first | second)._get_stock_shortages()
+        self.assertNotIn(first.id, shortages)
+        self.assertIn(second.id, shortages)
+
+    def test_sale_multi_warehouse_split(self):
+        """Avec une politique d'approvisionnement, la demande est répartie entre entrepôts"""
+        product = self.products[0]
+        second_warehouse = self.env['stock.warehouse'].create({'name': 'Entrepôt secondaire', 'code': 'SNP2'})
+        self.env['stock.quant']._update_available_quantity(product, second_warehouse.lot_stock_id, 5.0)
+        self.env['stock.prevention.source'].create([
+            {'warehouse_id': self.warehouse.id, 'sequence': 1},
+            {'warehouse_id': second_warehouse.id, 'sequence': 2},
+        ])
+        order = self._create_sale_order(1, qty=self.stock_per_product + 5.0)
+        shortages, splits = order._get_stock_allocation()
+        self.assertFalse(shortages)
+        self.assertEqual(splits[order.id], [
+            (product, [(self.warehouse, self.stock_per_product), (second_warehouse, 5.0)]),
+        ])
+        order.order_line.product_uom_qty = self.stock_per_product + 6.0
+        with self.assertRaises(UserError):
+            order._check_stock_availability()
+
+    def test_sale_multi_warehouse_shared_stock(self):
+        """Deux commandes d'entrepôts différents sous la même politique puisent dans le même stock"""
+        product = self.env['product.product'].create({'name': 'Produit partagé', 'type': 'consu', 'is_storable': True})
+        second_warehouse = self.env['stock.warehouse'].create({'name': 'Entrepôt secondaire', 'code': 'SNP2'})
+        self.env['stock.quant']._update_available_quantity(product, self.stock_location, 5.0)
+        self.env['stock.quant']._update_available_quantity(product, second_warehouse.lot_stock_id, 5.0)
+        self.env['stock.prevention.source'].create([
+            {'warehouse_id': self.warehouse.id, 'sequence': 1},
+            {'warehouse_id': second_warehouse.id, 'sequence': 2},
+        ])
+        orders = self.env['sale.order'].create([{
+            'partner_id': self.partner.id,
+            'warehouse_id': warehouse.id,
+            'order_line': [(0, 0, {'product_id': product.id, 'product_uom_qty': 8.0})],
+        } for warehouse in (self.warehouse, second_warehouse)])
+        shortages = orders._get_stock_shortages()
+        self.assertNotIn(orders[0].id, shortages)
+        self.assertIn(orders[1].id, shortages)
+
+    def test_sale_excluded_category(self):
+        """Les produits d'une catégorie exclue (sous-catégories incluses) ne sont pas vérifiés"""
+        parent = self.env['product.category'].create({'name': 'Catégorie exclue'})
+        self.products[0].categ_id = self.env['product.category'].create({'name': 'Sous-catégorie', 'parent_id': parent.id})
+        order = self._create_sale_order(1, qty=self.stock_per_product + 1.0)
+        with self.assertRaises(UserError):
+            order._check_stock_availability()
+        self.env.company.stock_prevention_excluded_categ_ids = parent
+        order._check_stock_availability()
+
+    def test_pos_config_disables_check(self):
+        """Un point de vente peut désactiver la vérification activée sur la société"""
+        payload = self._pos_order_payload(1, qty=self.stock_per_product + 1.0)
+        self.assertFalse(self.env['pos.order']._check_pos_orders_stock_availability([payload])[0]['ok'])
+        self.pos_config.stock_prevention_pos = 'disabled'
+        self.assertFalse(self.env['pos.order']._get_pos_stock_prevention_settings(self.pos_session.id)['pos'])
+
+    def test_sale_async_check_queue(self):
+        """Au-delà du seuil, la vérification est différée puis enregistrée sur la commande"""
+        self.env['ir.config_parameter'].set_param('stock_negative_prevention.async_line_threshold', '5')
+        order = self._create_sale_order(10, qty=self.stock_per_product + 1.0)
+        order.action_check_stock_availability()
+        self.assertEqual(order.stock_check_state, 'queued')
+        self.env['stock.prevention.check.queue']._cron_process_queue()
+        self.assertEqual(order.stock_check_state, 'short')
+        self.assertEqual(len(order.stock_shortage_report_id.line_ids), 10)
+
+    def test_sale_async_threshold_per_order(self):
+        """Le seuil s'applique à chaque commande : seules les grandes commandes sont différées"""
+        self.env['ir.config_parameter'].set_param('stock_negative_prevention.async_line_threshold', '5')
+        large_order = self._create_sale_order(10)
+        small_order = self._create_sale_order(2)
+        (large_order | small_order).action_check_stock_availability()
+        self.assertEqual(large_order.stock_check_state, 'queued')
+        self.assertEqual(small_order.stock_check_state, 'ok')
+        (large_order | small_order).with_context(stock_prevention_async=True).action_confirm()
+        self.assertEqual(large_order.state, 'draft')
+        self.assertEqual(small_order.state, 'sale')
+
+    def test_sale_shortage_report_reused(self):
+        """Le rapport est réutilisé tant que ni le stock ni la commande n'ont changé"""
+        order = self._create_sale_order(5, qty=self.stock_per_product + 1.0)
+        report = order._get_stock_shortage_report()
+        self.assertEqual(report.state, 'short')
+        self.assertEqual(report.line_ids.mapped('missing_qty'), [1.0] * 5)
+        self.assertEqual(order._get_stock_shortage_report(), report)
+        self.env['stock.quant']._update_available_quantity(self.products[0], self.stock_location, 1.0)
+        new_report = order._get_stock_shortage_report()
+        self.assertNotEqual(new_report, report)
+        self.assertEqual(len(new_report.line_ids), 4)
+
+    def test_availability_display_cache(self):
+        """Le cache court ne sert que les affichages : le moteur relit toujours le stock"""
+        StockQuant = self.env['stock.quant']
+        products = self.products[:5]
+        expected = StockQuant._get_available_quantity_map(products, self.stock_location)
+        cached = StockQuant._get_cached_available_quantity_map(products, self.stock_location, 60)
+        StockQuant._update_available_quantity(products[0], self.stock_location, 1.0)
+        self.assertEqual(StockQuant._get_cached_available_quantity_map(products, self.stock_location, 60), cached)
+        available = StockQuant._get_available_quantity_map(products, self.stock_location)
+        self.assertEqual(available[products[0].id], expected[products[0].id] + 1.0)
+
+    def test_pos_batch_sequential_decrement(self):
+        """Les commandes d'une synchronisation consomment le stock dans l'ordre de la file"""
+        payloads = [
+            self._pos_order_payload(1, qty=self.stock_per_product),
+            self._pos_order_payload(1, qty=1.0),
+        ]
+        verdicts = self.env['pos.order']._check_pos_orders_stock_availability(payloads)
+        self.assertEqual([verdict['ok'] for verdict in verdicts], [True, False])
+
+    def test_pos_sync_skips_existing_paid_order(self):
+        """Une commande déjà validée renvoyée par la caisse (pourboire saisi plus tard) n'est pas revérifiée"""
+        existing_order = self.env['pos.order'].create({
+            'session_id': self.pos_session.id,
+            'state': 'paid',
+            'amount_tax': 0.0,
+            'amount_total': 0.0,
+            'amount_paid': 0.0,
+            'amount_return': 0.0,
+        })
+        payload = dict(self._pos_order_payload(1, qty=self.stock_per_product + 1.0), uuid=existing_order.uuid)
+        self.env['pos.order'].sync_from_ui([payload])
+        self.assertEqual(existing_order.state, 'paid')
+
+    def test_snapshot_incremental_maintenance(self):
+        """La table de disponibilité maintenue au fil des écritures reste égale aux quants"""
+        self.env['ir.config_parameter'].set_param('stock_negative_prevention.use_snapshot', 'True')
+        Snapshot = self.env['stock.available.snapshot']
+        Snapshot._rebuild()
+        StockQuant = self.env['stock.quant']
+        product = self.products[0]
+
+        quant = StockQuant.create({'product_id': product.id, 'location_id': self.bins[0].id, 'quantity': 5.0})
+        self.assertEqual(Snapshot._verify(), [])
+        quant.quantity = 7.0
+        self.assertEqual(Snapshot._verify(), [])
+        quant.unlink()
+        self.assertEqual(Snapshot._verify(), [])
+
+        # Inventaire sur un quant existant (retrouvé par create) puis sur un nouveau quant
+        existing_quant = StockQuant.search([('product_id', '=', self.products[1].id)], limit=1)
+        InventoryQuant = StockQuant.with_context(inventory_mode=True)
+        InventoryQuant.create({
+            'product_id': self.products[1].id,
+            'location_id': existing_quant.location_id.id,
+            'inventory_quantity': existing_quant.quantity + 3.0,
+        }).action_apply_inventory()
+        self.assertEqual(Snapshot._verify(), [])
+        new_location = self.env['stock.location'].create({
+            'name': 'Casier inventaire',
+            'location_id': self.stock_location.id,
+            'usage': 'internal',
+        })
+        InventoryQuant.create({
+            'product_id': product.id,
+            'location_id': new_location.id,
+            'inventory_quantity': 4.0,
+        }).action_apply_inventory()
+        self.assertEqual(Snapshot._verify(), [])
+        self.assertEqual(
+            Snapshot._get_available_quantity_map(product, self.stock_location)[product.id],
+            self.stock_per_product + 4.0,
+        )
+
+    def test_sale_line_availability_only_for_checked_quotations(self):
+        """L'indicateur de disponibilité n'est calculé que pour les devis d'une société vérifiée"""
+        order = self._create_sale_order(1)
+        line = order.order_line
+        self.assertEqual(line.stock_prevention_available_qty, self.stock_per_product)
+        self.env.company.prevent_negative_stock_sales = False
+        line.invalidate_recordset(['stock_prevention_available_qty'])
+        self.assertEqual(line.stock_prevention_available_qty, 0.0)
+
+    def test_sale_line_short_on_cumulated_demand(self):
+        """Deux lignes du même produit, chacune couverte seule : l'indicateur signale le manque"""
+        qty = self.stock_per_product * 0.75
+        order = self._create_sale_order(1, qty)
+        self.assertFalse(order.order_line.stock_prevention_short)
+        order.order_line = [(0, 0, {'product_id': self.products[0].id, 'product_uom_qty': qty})]
+        self.assertEqual(order.order_line.mapped('stock_prevention_short'), [True, True])
+
+    def test_metrics_sampling(self):
+        """Hors échantillon, la vérification est comptée sans mesure de durée"""
+        Metrics = self.env['stock.prevention.metrics']
+        self.env['ir.config_parameter'].set_param('stock_negative_prevention.metrics_sample_rate', '0')
+        before = Metrics._get_metrics().get('sale', {'checks': 0, 'sampled': 0})
+        self._create_sale_order(1)._check_stock_availability()
+        after = Metrics._get_metrics()['sale']
+        self.assertGreater(after['checks'], before['checks'])
+        self.assertEqual(after['sampled'], before['sampled'])
+
+    def test_sale_forecast_allocation(self):
+        """En mode prévisionnel, une réception avant la date d'engagement est comptée
+        et une livraison prévue après reste due"""
+        self.env['ir.config_parameter'].set_param('stock_negative_prevention.check_mode', 'forecast')
+        product = self.products[0]
+        commitment_date = fields.Datetime.now() + timedelta(days=10)
+        self.env['stock.move'].create([{
+            'name': 'Réception prévue',
+            'product_id': product.id,
+            'product_uom_qty': 5.0,
+            'product_uom': product.uom_id.id,
+            'location_id': self.env.ref('stock.stock_location_suppliers').id,
+            'location_dest_id': self.stock_location.id,
+            'date': commitment_date - timedelta(days=1),
+        }, {
+            'name': 'Livraison prévue',
+            'product_id': product.id,
+            'product_uom_qty': 3.0,
+            'product_uom': product.uom_id.id,
+            'location_id': self.stock_location.id,
+            'location_dest_id': self.env.ref('stock.stock_location_customers').id,
+            'date': commitment_date + timedelta(days=1),
+        }])._action_confirm()
+
+        order = self._create_sale_order(1, qty=self.stock_per_product + 2.0)
+        order.commitment_date = commitment_date
+        self.assertFalse(order._get_stock_allocation()[0])
+        order.order_line.product_uom_qty = self.stock_per_product + 3.0
+        shortages = order._get_stock_allocation()[0]
+        self.assertEqual(shortages[order.id][0]['available'], self.stock_per_product + 2.0)
+
+        # Engagement avant la réception : seul le stock physique compte
+        order.commitment_date = commitment_date - timedelta(days=2)
+        order.order_line.product_uom_qty = self.stock_per_product + 1.0
+        shortages = order._get_stock_allocation()[0]
+        self.assertEqual(shortages[order.id][0]['available'], self.stock_per_product)
+
+    def test_sale_async_check_orders_independent(self):
+        """Dans la file, des devis seulement vérifiés ne se disputent pas le stock"""
+        self.env['ir.config_parameter'].set_param('stock_negative_prevention.async_line_threshold', '1')
+        orders = self._create_sale_order(2, qty=self.stock_per_product) | self._create_sale_order(2, qty=self.stock_per_product)
+        orders.action_check_stock_availability()
+        self.env['stock.prevention.check.queue']._cron_process_queue()
+        self.assertEqual(orders.mapped('stock_check_state'), ['ok', 'ok'])
+
+    def test_availability_cache_location_moved(self):
+        """Déplacer un casier hors de l'emplacement invalide la disponibilité en cache,
+        même si aucun quant n'est écrit"""
+        StockQuant = self.env['stock.quant']
+        product = self.products[:1]
+        StockQuant._get_cached_available_quantity_map(product, self.stock_location, 60)
+
+        quant = StockQuant.search([
+            ('product_id', '=', product.id),
+            ('location_id', 'in', self.bins.filtered(lambda location: not location.child_ids).ids),
+        ], limit=1)
+        quant.location_id.location_id = self.env['stock.location'].create({
+            'name': 'Hors stock',
+            'location_id': self.warehouse.view_location_id.id,
+            'usage': 'internal',
+        })
+        available = StockQuant._get_cached_available_quantity_map(product, self.stock_location, 60)
+        self.assertEqual(available[product.id], self.stock_per_product - quant.quantity)
+
+    def test_snapshot_location_moved(self):
+        """Déplacer un casier met à jour la table de disponibilité des seuls entrepôts concernés"""
+        self.env['ir.config_parameter'].set_param('stock_negative_prevention.use_snapshot', 'True')
+        Snapshot = self.env['stock.available.snapshot']
+        Snapshot._rebuild()
+        other_warehouse = self.env['stock.warehouse'].create({'name': 'Entrepôt réception', 'code': 'SNP3'})
+        bin_location = self.bins.filtered(lambda location: not location.child_ids)[:1]
+        with patch.object(type(Snapshot), '_rebuild', autospec=True, side_effect=type(Snapshot)._rebuild) as rebuild:
+            bin_location.location_id = other_warehouse.lot_stock_id
+        rebuilt_locations = rebuild.call_args.args[1]
+        self.assertEqual(rebuilt_locations, self.stock_location | other_warehouse.lot_stock_id)
+        self.assertEqual(Snapshot._verify(), [])
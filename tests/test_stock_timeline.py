@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+from odoo.tests import BaseCase, tagged
+
+from odoo.addons.stock_negative_prevention.models.stock_quant import StockTimeline
+
+D1 = datetime(2026, 1, 10)
+D2 = datetime(2026, 1, 20)
+D3 = datetime(2026, 1, 30)
+
+
+@tagged('post_install', '-at_install')
+class TestStockTimeline(BaseCase):
+    """Projection du mode prévisionnel, sans base de données"""
+
+    def test_without_events(self):
+        """Sans mouvement, la disponibilité est la quantité de départ à toute date"""
+        timeline = StockTimeline(5.0)
+        self.assertEqual(timeline.available_at(), 5.0)
+        self.assertEqual(timeline.available_at(D1), 5.0)
+        timeline.consume(2.0, D1)
+        self.assertEqual(timeline.available_at(), 3.0)
+        self.assertEqual(timeline.available_at(D3), 3.0)
+
+    def test_suffix_minimum(self):
+        """La quantité promise à une date doit rester disponible pour les sorties ultérieures"""
+        # 10 en stock, réception de 5 le 10, livraison de 12 le 20, réception de 8 le 30
+        timeline = StockTimeline(10.0, [(D3, 8.0), (D1, 5.0), (D2, -12.0)])
+        self.assertEqual(timeline.available_at(D1 - timedelta(days=1)), 3.0)
+        self.assertEqual(timeline.available_at(D1), 3.0)
+        self.assertEqual(timeline.available_at(D2), 3.0)
+        self.assertEqual(timeline.available_at(D3), 11.0)
+        self.assertEqual(timeline.available_at(D3 + timedelta(days=1)), 11.0)
+
+    def test_without_date_all_moves_are_future(self):
+        """Sans date, les mouvements (même en retard) sont tous considérés comme à venir"""
+        timeline = StockTimeline(10.0, [(D1, -4.0), (D2, 6.0)])
+        self.assertEqual(timeline.available_at(), 6.0)
+        self.assertEqual(timeline.available_at(D2), 12.0)
+
+    def test_move_at_check_date(self):
+        """Un mouvement à la date demandée est compté comme passé (bisect_right)"""
+        timeline = StockTimeline(0.0, [(D1, 5.0)])
+        self.assertEqual(timeline.available_at(D1), 5.0)
+        self.assertEqual(timeline.available_at(D1 - timedelta(seconds=1)), 0.0)
+        # Une consommation à la même date est placée après la réception
+        timeline.consume(5.0, D1)
+        self.assertEqual(timeline.events, [(D1, 5.0), (D1, -5.0)])
+        self.assertEqual(timeline.available_at(D1), 0.0)
+
+    def test_consume(self):
+        """Sans date, la consommation réduit le stock de départ ; datée, elle devient un mouvement"""
+        timeline = StockTimeline(10.0, [(D2, -4.0)])
+        timeline.consume(3.0)
+        self.assertEqual(timeline.base, 7.0)
+        self.assertEqual(timeline.available_at(D1), 3.0)
+        timeline.consume(2.0, D3)
+        self.assertEqual(timeline.events, [(D2, -4.0), (D3, -2.0)])
+        self.assertEqual(timeline.available_at(D1), 1.0)
+        self.assertEqual(timeline.available_at(D3), 1.0)